@@ -1,18 +1,158 @@
 # app.py (Logging Robusto, Integración con daloRADIUS y Clave de API)
 
 import os
+import re
+import json
+import time
+import base64
+import bisect
+import atexit
+import queue
+import random
+import uuid
+import hashlib
+import itertools
+import csv
+import io
+import zlib
+import threading
 import pymysql
 import logging
-from flask import Flask, jsonify, request
-from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from flask import Flask, Response, g, has_request_context, jsonify, request, url_for
+from datetime import date, datetime, timedelta
 from functools import wraps
+from pymysql.constants import SERVER_STATUS
 
 # --- Configuración de Logging ---
-# Esto asegura que los logs se muestren en la consola de Azure
-logging.basicConfig(level=logging.INFO)
+# Esto asegura que los logs se muestren en la consola de Azure.
+# Con LOG_ASYNC=1 (por defecto) los registros se encolan sin formatear y un hilo aparte
+# los formatea y escribe, de modo que las peticiones nunca esperan por la E/S del log.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# 'text' (formato clásico) o 'json' (un objeto por línea con el contexto de la petición)
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+LOG_ASYNC = os.environ.get('LOG_ASYNC', '1') == '1'
+# Muestreo por nivel de los mensajes de conexión a la base de datos, p. ej. "INFO=0.1,DEBUG=0"
+LOG_SAMPLE_RATES = os.environ.get('LOG_SAMPLE_RATES', 'INFO=0.1')
+
+class RequestContextFilter(logging.Filter):
+    """Añade a cada registro el id de petición, método, ruta y usuario de la petición en curso."""
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get('request_id')
+            record.method = request.method
+            record.route = request.url_rule.rule if request.url_rule else request.path
+            record.username = (request.view_args or {}).get('username')
+        return True
+
+class SamplingFilter(logging.Filter):
+    """Deja pasar solo una fracción de los registros de cada nivel (los niveles sin tasa pasan siempre)."""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        rate = self.rates.get(record.levelno, 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+def parse_sample_rates(spec):
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        level, _, rate = item.partition('=')
+        rates[logging.getLevelName(level.strip().upper())] = float(rate)
+    return rates
+
+class JsonFormatter(logging.Formatter):
+    """Formatea cada registro como un objeto JSON en una sola línea."""
+
+    CONTEXT_FIELDS = ('request_id', 'method', 'route', 'username', 'status', 'duration_ms')
+
+    def format(self, record):
+        doc = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in self.CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                doc[field] = value
+        if record.exc_info:
+            doc['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(doc, ensure_ascii=False, default=str)
+
+class LazyQueueHandler(QueueHandler):
+    """Encola el registro tal cual; el mensaje se formatea en el hilo del QueueListener."""
+
+    def prepare(self, record):
+        return record
+
+class AsyncLogPipeline:
+    """Cola en memoria + QueueListener que escribe en `handler` desde un hilo propio."""
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.queue_handler = LazyQueueHandler(queue.SimpleQueue())
+        self.listener = None
+        self.start()
+
+    def start(self):
+        # También se llama en el hijo tras un fork: el hilo del padre no existe allí
+        self.queue_handler.queue = queue.SimpleQueue()
+        self.listener = QueueListener(self.queue_handler.queue, self.handler, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        self.listener.stop()
+
+def configure_logging():
+    root = logging.getLogger()
+    if root.handlers:
+        # Igual que logging.basicConfig: respetar una configuración previa (p. ej. del servidor)
+        return None
+    root.setLevel(LOG_LEVEL)
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else logging.Formatter(logging.BASIC_FORMAT))
+    if not LOG_ASYNC:
+        handler.addFilter(RequestContextFilter())
+        root.addHandler(handler)
+        return None
+    pipeline = AsyncLogPipeline(handler)
+    # El contexto de la petición se captura en el hilo que registra, antes de encolar
+    pipeline.queue_handler.addFilter(RequestContextFilter())
+    root.addHandler(pipeline.queue_handler)
+    os.register_at_fork(after_in_child=pipeline.start)
+    atexit.register(lambda: pipeline.stop())
+    return pipeline
+
+log_pipeline = configure_logging()
 
 app = Flask(__name__)
 
+# Mensajes de conexión a la base de datos, muy frecuentes: se muestrean según LOG_SAMPLE_RATES
+conn_logger = app.logger.getChild('conexion')
+conn_logger.addFilter(SamplingFilter(parse_sample_rates(LOG_SAMPLE_RATES)))
+
+@app.before_request
+def assign_request_id():
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    # Único cronómetro de la petición: lo usan este log y las métricas HTTP
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def log_request(response):
+    response.headers['X-Request-ID'] = g.get('request_id', '')
+    started = g.get('request_started')
+    duration_ms = round((time.perf_counter() - started) * 1000, 2) if started is not None else None
+    app.logger.info("%s %s %s", request.method, request.path, response.status_code,
+                    extra={'status': response.status_code, 'duration_ms': duration_ms})
+    return response
+
 # --- Configuración de la Base de Datos y Clave de API ---
 DB_HOST = os.environ.get('DB_HOST')
 DB_USER = os.environ.get('DB_USER')
@@ -20,6 +160,78 @@ DB_PASSWORD = os.environ.get('DB_PASSWORD')
 DB_NAME = os.environ.get('DB_NAME')
 # Leemos la clave secreta de la API desde las variables de entorno
 API_KEY = os.environ.get('API_KEY')
+DB_CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT', '10'))
+
+# --- Configuración de métricas ---
+# 1 expone /metrics sin clave de API (p. ej. para un scraper de Prometheus en red interna)
+METRICS_PUBLIC = os.environ.get('METRICS_PUBLIC', '0') == '1'
+# Milisegundos a partir de los cuales se registra una consulta lenta (0 = desactivado)
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', '0'))
+
+# --- Configuración del pool de conexiones ---
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', '1'))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '10'))
+# Segundos máximos que una petición espera por una conexión libre
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '5'))
+# Segundos tras los cuales una conexión se cierra y se reemplaza (0 = nunca)
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', '3600'))
+# Segundos de inactividad tras los cuales se hace ping antes de reutilizar una conexión
+DB_POOL_PING_INTERVAL = int(os.environ.get('DB_POOL_PING_INTERVAL', '30'))
+
+# --- Configuración de la caché de atributos de usuario ---
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '10000'))
+# Segundos de vida de cada entrada (0 desactiva la caché)
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', '30'))
+# Backend compartido opcional entre procesos (requiere el paquete `redis`)
+USER_CACHE_REDIS_URL = os.environ.get('USER_CACHE_REDIS_URL')
+
+# --- Configuración de la exportación completa ---
+# Bytes acumulados antes de enviar (y comprimir) cada fragmento de la respuesta
+EXPORT_CHUNK_BYTES = int(os.environ.get('EXPORT_CHUNK_BYTES', '65536'))
+EXPORT_GZIP_LEVEL = int(os.environ.get('EXPORT_GZIP_LEVEL', '6'))
+
+# --- Configuración de la consulta en lote ---
+LOOKUP_MAX_USERNAMES = int(os.environ.get('LOOKUP_MAX_USERNAMES', '1000'))
+
+# --- Configuración de planes de servicio ---
+# Prioridad con la que se asigna el grupo del plan en radusergroup
+PLAN_PRIORITY = int(os.environ.get('PLAN_PRIORITY', '1'))
+# Solo los grupos con este prefijo son planes; el resto (p. ej. daloRADIUS-Disabled-Users) no se toca
+PLAN_GROUP_PREFIX = os.environ.get('PLAN_GROUP_PREFIX', 'plan-')
+
+# --- Configuración de los trabajos en segundo plano ---
+# 0 desactiva el hilo de trabajos en este proceso (p. ej. si se usa `flask jobs-worker` aparte)
+JOBS_WORKER_ENABLED = os.environ.get('JOBS_WORKER_ENABLED', '1') == '1'
+JOBS_POLL_INTERVAL = float(os.environ.get('JOBS_POLL_INTERVAL', '5'))
+# Un trabajo 'running' sin progreso durante este tiempo se considera abandonado y se reanuda
+JOBS_STALE_AFTER = int(os.environ.get('JOBS_STALE_AFTER', '300'))
+JOBS_MAX_ATTEMPTS = int(os.environ.get('JOBS_MAX_ATTEMPTS', '3'))
+# Filas de radacct borradas por sentencia y pausa entre bloques
+ACCT_PURGE_CHUNK_SIZE = int(os.environ.get('ACCT_PURGE_CHUNK_SIZE', '5000'))
+ACCT_PURGE_SLEEP = float(os.environ.get('ACCT_PURGE_SLEEP', '0.1'))
+
+# --- Configuración de los resúmenes de contabilidad (radacct) ---
+ROLLUP_ENABLED = os.environ.get('ROLLUP_ENABLED', '1') == '1'
+# Segundos entre ejecuciones del agregador y filas de radacct procesadas por lote
+ROLLUP_INTERVAL = float(os.environ.get('ROLLUP_INTERVAL', '60'))
+ROLLUP_BATCH_SIZE = int(os.environ.get('ROLLUP_BATCH_SIZE', '50000'))
+# Segundos que deben pasar desde que se ve un radacctid hasta procesarlo: un INSERT con un id
+# menor puede confirmarse después que otro con un id mayor y no debe quedar detrás de la marca
+ROLLUP_SAFETY_LAG = float(os.environ.get('ROLLUP_SAFETY_LAG', '30'))
+# Pausa entre lotes consecutivos (p. ej. durante la puesta al día inicial)
+ROLLUP_BATCH_SLEEP = float(os.environ.get('ROLLUP_BATCH_SLEEP', '0.1'))
+# Una sesión abierta sin actualizaciones durante este tiempo se contabiliza como cerrada
+ROLLUP_STALE_AFTER = int(os.environ.get('ROLLUP_STALE_AFTER', '86400'))
+ACTIVE_SESSIONS_MAX_LIMIT = int(os.environ.get('ACTIVE_SESSIONS_MAX_LIMIT', '1000'))
+
+# --- Configuración del alta masiva ---
+# Filas por transacción en POST /usuarios/bulk (se puede ajustar con ?chunk_size=)
+BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE', '500'))
+BULK_MAX_CHUNK_SIZE = int(os.environ.get('BULK_MAX_CHUNK_SIZE', '5000'))
+
+# --- Configuración del listado de usuarios ---
+USERS_PAGE_SIZE = int(os.environ.get('USERS_PAGE_SIZE', '100'))
+USERS_MAX_PAGE_SIZE = int(os.environ.get('USERS_MAX_PAGE_SIZE', '1000'))
 
 # --- Decorador para la autenticación con Clave de API ---
 def require_api_key(f):
@@ -33,29 +245,1278 @@ def require_api_key(f):
         # Obtenemos la clave del encabezado 'X-API-Key' de la petición
         provided_key = request.headers.get('X-API-Key')
         if not provided_key or provided_key != API_KEY:
-            app.logger.warning(f"Acceso denegado. Se proporcionó una clave de API incorrecta o ninguna.")
+            app.logger.warning("Acceso denegado. Se proporcionó una clave de API incorrecta o ninguna.")
             return jsonify({"error": "No autorizado. Se requiere una clave de API válida."}), 401
         
         return f(*args, **kwargs)
     return decorated_function
 
-def get_db_connection():
-    """Crea una conexión a la base de datos."""
+# --- Métricas ---
+# Registro mínimo compatible con el formato de texto de Prometheus. Las métricas son
+# por proceso: con varios workers de gunicorn cada uno expone las suyas.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(labelnames, labelvalues)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def expose(self):
+        with self._lock:
+            values = list(self._values.items())
+        return self.header() + [f'{self.name}{_format_labels(self.labelnames, labels)} {value}'
+                                for labels, value in values]
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, *labelvalues, amount=1):
+        self.inc(*labelvalues, amount=-amount)
+
+    def set(self, *labelvalues, value):
+        with self._lock:
+            self._values[labelvalues] = value
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labelvalues)
+            if state is None:
+                # [conteos por bucket (+Inf al final), suma]
+                state = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def expose(self):
+        with self._lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+        lines = self.header()
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, labels)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}')
+        return lines
+
+http_request_duration = Histogram('radius_api_http_request_duration_seconds',
+                                  'Duración de las peticiones HTTP por ruta.', ['method', 'route'])
+http_requests_total = Counter('radius_api_http_requests_total',
+                              'Peticiones HTTP atendidas por ruta y código de estado.', ['method', 'route', 'status'])
+http_requests_in_flight = Gauge('radius_api_http_requests_in_flight', 'Peticiones HTTP en curso.')
+db_connect_duration = Histogram('radius_api_db_connect_duration_seconds',
+                                'Tiempo para abrir una conexión física a la base de datos.')
+db_query_duration = Histogram('radius_api_db_query_duration_seconds',
+                              'Tiempo de ejecución de sentencias SQL por tipo de sentencia y tabla.', ['statement'])
+db_commit_duration = Histogram('radius_api_db_commit_duration_seconds', 'Tiempo de los COMMIT.')
+db_errors_total = Counter('radius_api_db_errors_total', 'Errores de base de datos por tipo de sentencia.', ['statement'])
+
+METRICS = (http_request_duration, http_requests_total, http_requests_in_flight,
+           db_connect_duration, db_query_duration, db_commit_duration, db_errors_total)
+
+_STATEMENT_RE = re.compile(
+    r"^\s*(?:(UPDATE)\s+|(SELECT|INSERT|DELETE|CREATE|REPLACE)\b.*?\b(?:FROM|INTO|TABLE(?: IF NOT EXISTS)?)\s+)`?(\w+)`?",
+    re.IGNORECASE | re.DOTALL)
+
+def _query_text(query, limit):
+    """Primeros `limit` caracteres de la sentencia como str (executemany() envía bytearray)."""
+    if isinstance(query, (bytes, bytearray)):
+        return bytes(query[:limit]).decode('utf-8', 'replace')
+    return query[:limit]
+
+def statement_label(query):
+    """Etiqueta de baja cardinalidad para una sentencia, p. ej. 'UPDATE radcheck'."""
+    query = _query_text(query, 400)
+    match = _STATEMENT_RE.match(query)
+    if match is None:
+        return query.split(None, 1)[0].upper() if query.strip() else 'OTHER'
+    return f'{(match.group(1) or match.group(2)).upper()} {match.group(3)}'
+
+class _TimedCursorMixin:
+    """Mide cada execute(); executemany() multi-fila se mide por cada sentencia enviada."""
+
+    def execute(self, query, args=None):
+        label = statement_label(query)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, args)
+        except pymysql.MySQLError as e:
+            db_errors_total.inc(label)
+            _mark_if_broken(self.connection, e)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            db_query_duration.observe(elapsed, label)
+            if SLOW_QUERY_THRESHOLD_MS and elapsed * 1000 >= SLOW_QUERY_THRESHOLD_MS:
+                # Sin parámetros para no volcar contraseñas al log
+                app.logger.warning("Consulta lenta (%.1f ms) [%s]: %s", elapsed * 1000, label,
+                                   _query_text(query, 200) if args is not None else label)
+
+class TimedDictCursor(_TimedCursorMixin, pymysql.cursors.DictCursor):
+    pass
+
+class TimedSSDictCursor(_TimedCursorMixin, pymysql.cursors.SSDictCursor):
+    pass
+
+def _mark_if_broken(conn, error):
+    # Errores de red/protocolo: el pool descartará la conexión al devolverla
+    if isinstance(error, (pymysql.OperationalError, pymysql.InterfaceError)) and conn is not None:
+        conn.broken = True
+
+class TimedConnection(pymysql.connections.Connection):
+    """Conexión PyMySQL que mide la duración de los COMMIT y recuerda si sufrió un error de red."""
+
+    broken = False
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        except pymysql.MySQLError as e:
+            _mark_if_broken(self, e)
+            raise
+        finally:
+            db_commit_duration.observe(time.perf_counter() - started)
+
+@app.before_request
+def track_request_in_flight():
+    http_requests_in_flight.inc()
+
+@app.after_request
+def record_request_metrics(response):
+    # g.request_started lo fija assign_request_id()
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        http_request_duration.observe(time.perf_counter() - started, request.method, route)
+        http_requests_total.inc(request.method, route, str(response.status_code))
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    http_requests_in_flight.dec()
+
+def create_db_connection():
+    """Abre una nueva conexión física a la base de datos (la usa el pool)."""
+    conn_logger.info("Intentando conectar a la base de datos...")
+    started = time.perf_counter()
+    connection = TimedConnection(host=DB_HOST,
+                                 user=DB_USER,
+                                 password=DB_PASSWORD,
+                                 database=DB_NAME,
+                                 cursorclass=TimedDictCursor,
+                                 connect_timeout=DB_CONNECT_TIMEOUT)
+    db_connect_duration.observe(time.perf_counter() - started)
+    conn_logger.info("¡Conexión a la base de datos exitosa!")
+    return connection
+
+# --- Pool de conexiones ---
+# Cada proceso (worker de gunicorn) mantiene su propio pool. Las conexiones se
+# reutilizan entre peticiones para evitar el handshake TCP+TLS+auth en cada una.
+
+class DatabaseUnavailableError(Exception):
+    """No fue posible obtener una conexión del pool."""
+    status_code = 500
+
+class PoolTimeoutError(DatabaseUnavailableError):
+    """Se agotó el tiempo de espera para obtener una conexión libre."""
+    status_code = 503
+
+class _PooledConnection:
+    __slots__ = ('conn', 'created_at', 'last_used')
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = self.last_used = time.monotonic()
+
+class _Waiter:
+    """Hilo en la cola de espera del pool: recibe una conexión ociosa o permiso para abrir una."""
+    __slots__ = ('cond', 'entry', 'may_open')
+
+    def __init__(self, lock):
+        self.cond = threading.Condition(lock)
+        self.entry = None
+        self.may_open = False
+
+class ConnectionPool:
+    """
+    Pool de conexiones thread-safe con tamaño mínimo/máximo, tiempo máximo de
+    espera, ping de vida para conexiones ociosas y reciclaje por antigüedad.
+    Los hilos que esperan se atienden por orden de llegada: una conexión devuelta
+    se entrega directamente al que lleva más tiempo esperando.
+    `creator` es cualquier callable que devuelva una conexión tipo PyMySQL, lo
+    que permite usar un MySQL/MariaDB local o un sustituto en proceso.
+    """
+
+    def __init__(self, creator, min_size=1, max_size=10, timeout=5.0,
+                 recycle=3600, ping_interval=30):
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError("Tamaños de pool inválidos")
+        self._creator = creator
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_interval = ping_interval
+        self._lock = threading.Lock()
+        self._reset_state()
+
+    def _reset_state(self):
+        self._pid = os.getpid()
+        self._idle = deque()
+        self._waiters = deque()
+        self._size = 0
+        self._in_use = 0
+        self._warmed = False
+        self._stats = {
+            'created': 0, 'discarded': 0, 'checkouts': 0, 'waits': 0,
+            'timeouts': 0, 'wait_time_total': 0.0, 'wait_time_max': 0.0,
+        }
+
+    def _check_fork(self):
+        # Tras un fork (p. ej. gunicorn --preload) no se comparten sockets con el padre.
+        if self._pid != os.getpid():
+            self._reset_state()
+
+    def _put_idle_locked(self, entry):
+        """Entrega `entry` al primer hilo en espera o la deja ociosa. Requiere self._lock."""
+        if self._waiters:
+            waiter = self._waiters.popleft()
+            waiter.entry = entry
+            waiter.cond.notify()
+        else:
+            self._idle.append(entry)
+
+    def _free_slot_locked(self):
+        """Libera un hueco del tamaño máximo; si hay espera, lo cede al primero. Requiere self._lock."""
+        if self._waiters:
+            waiter = self._waiters.popleft()
+            waiter.may_open = True
+            waiter.cond.notify()
+        else:
+            self._size -= 1
+
+    def _open(self):
+        """Abre una conexión en un hueco ya reservado (self._size ya lo cuenta)."""
+        try:
+            entry = _PooledConnection(self._creator())
+        except Exception:
+            with self._lock:
+                self._free_slot_locked()
+            raise
+        with self._lock:
+            self._stats['created'] += 1
+        return entry
+
+    def _close(self, entry):
+        try:
+            entry.conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._stats['discarded'] += 1
+
+    def _discard(self, entry):
+        self._close(entry)
+        with self._lock:
+            self._free_slot_locked()
+
+    def _warm(self):
+        """Abre las conexiones mínimas la primera vez que se usa el pool."""
+        self._warmed = True
+        for _ in range(self.min_size):
+            with self._lock:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                entry = self._open()
+            except Exception as e:
+                app.logger.warning("No se pudo precalentar el pool de conexiones: %s", e)
+                return
+            with self._lock:
+                self._put_idle_locked(entry)
+
+    def _is_usable(self, entry):
+        if _is_broken(entry.conn):
+            return False
+        now = time.monotonic()
+        if self.recycle and now - entry.created_at > self.recycle:
+            return False
+        if self.ping_interval is not None and now - entry.last_used > self.ping_interval:
+            try:
+                entry.conn.ping(reconnect=False)
+            except Exception:
+                return False
+        return True
+
+    def acquire(self):
+        """Obtiene una conexión; lanza DatabaseUnavailableError si no es posible."""
+        with self._lock:
+            self._check_fork()
+            warm = not self._warmed
+        if warm:
+            self._warm()
+
+        started = time.monotonic()
+        waited = False
+        entry = None
+        with self._lock:
+            # Si ya hay hilos esperando, los recién llegados se ponen a la cola
+            if self._idle and not self._waiters:
+                entry = self._idle.pop()
+            elif self._size < self.max_size and not self._waiters:
+                self._size += 1
+            else:
+                waited = True
+                self._stats['waits'] += 1
+                waiter = _Waiter(self._lock)
+                self._waiters.append(waiter)
+                deadline = started + self.timeout
+                while waiter.entry is None and not waiter.may_open:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._waiters.remove(waiter)
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeoutError(
+                            f"Tiempo de espera agotado ({self.timeout}s) para obtener una conexión")
+                    waiter.cond.wait(remaining)
+                entry = waiter.entry
+
+        if entry is not None and not self._is_usable(entry):
+            # Se reemplaza en el mismo hueco para no perder el turno
+            self._close(entry)
+            entry = None
+        if entry is None:
+            try:
+                entry = self._open()
+            except pymysql.MySQLError as e:
+                app.logger.error("ERROR al conectar a la base de datos: %s", e)
+                raise DatabaseUnavailableError(str(e)) from e
+
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self._in_use += 1
+            self._stats['checkouts'] += 1
+            if waited:
+                self._stats['wait_time_total'] += elapsed
+                self._stats['wait_time_max'] = max(self._stats['wait_time_max'], elapsed)
+        return entry
+
+    def release(self, entry, broken=False):
+        """Devuelve la conexión al pool, descartándola si quedó en mal estado."""
+        with self._lock:
+            self._in_use -= 1
+            if self._pid != os.getpid():
+                return
+        # Un error de red puede haberse capturado dentro de la ruta sin llegar a `broken`
+        broken = broken or _is_broken(entry.conn)
+        if not broken and _in_transaction(entry.conn):
+            # Cerrar cualquier transacción abierta (aunque sea de solo lectura)
+            # para que el siguiente uso no vea una instantánea antigua.
+            try:
+                entry.conn.rollback()
+            except Exception:
+                broken = True
+        if broken or (self.recycle and time.monotonic() - entry.created_at > self.recycle):
+            self._discard(entry)
+            return
+        entry.last_used = time.monotonic()
+        with self._lock:
+            self._put_idle_locked(entry)
+
+    def close(self):
+        """Cierra todas las conexiones ociosas."""
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for entry in idle:
+            self._discard(entry)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'size': self._size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'waiting': len(self._waiters),
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+            })
+        checkouts = stats['checkouts']
+        stats['wait_time_avg'] = stats['wait_time_total'] / checkouts if checkouts else 0.0
+        return stats
+
+def _is_broken(conn):
+    """La conexión perdió el socket o sufrió un error de red (aunque la ruta lo haya capturado)."""
+    return not getattr(conn, 'open', True) or getattr(conn, 'broken', False)
+
+def _in_transaction(conn):
+    status = getattr(conn, 'server_status', None)
+    if status is None:
+        return True
+    return bool(status & SERVER_STATUS.SERVER_STATUS_IN_TRANS)
+
+db_pool = ConnectionPool(create_db_connection,
+                         min_size=DB_POOL_MIN_SIZE,
+                         max_size=DB_POOL_MAX_SIZE,
+                         timeout=DB_POOL_TIMEOUT,
+                         recycle=DB_POOL_RECYCLE,
+                         ping_interval=DB_POOL_PING_INTERVAL)
+
+@contextmanager
+def db_connection():
+    """
+    Presta una conexión del pool durante el bloque `with`.
+    Si el bloque termina con una excepción la conexión se descarta.
+    """
+    entry = db_pool.acquire()
+    broken = False
     try:
-        app.logger.info("Intentando conectar a la base de datos...")
-        connection = pymysql.connect(host=DB_HOST,
-                                     user=DB_USER,
-                                     password=DB_PASSWORD,
-                                     database=DB_NAME,
-                                     cursorclass=pymysql.cursors.DictCursor,
-                                     connect_timeout=10)
-        app.logger.info("¡Conexión a la base de datos exitosa!")
-        return connection
-    except pymysql.MySQLError as e:
-        # Usamos app.logger.error para un registro más robusto
-        app.logger.error(f"ERROR al conectar a la base de datos: {e}")
+        yield entry.conn
+    except BaseException:
+        # Incluye GeneratorExit de respuestas en streaming cortadas a mitad
+        broken = True
+        raise
+    finally:
+        db_pool.release(entry, broken=broken)
+
+@app.errorhandler(DatabaseUnavailableError)
+def handle_database_unavailable(e):
+    app.logger.error("Base de datos no disponible: %s", e)
+    return jsonify({'error': 'No se pudo conectar a la base de datos'}), e.status_code
+
+# --- Caché de atributos de usuario ---
+# Caché de lectura para GET /usuarios/<username>. Cada proceso tiene una LRU con TTL o,
+# si se configura un backend externo (p. ej. Redis), todos los procesos usan solo ese
+# backend, de modo que una invalidación en un worker vale para todos.
+# Las rutas que modifican un usuario llaman a user_cache.invalidate() tras el commit.
+
+class RedisCacheBackend:
+    """
+    Backend compartido sobre Redis. Guarda cada documento como JSON con expiración y una
+    versión por usuario que se incrementa al invalidar: un proceso solo guarda lo que leyó
+    si la versión no cambió desde antes de consultar la base de datos.
+    """
+
+    # Las versiones sobreviven de sobra a cualquier lectura en curso
+    VERSION_TTL_MS = 86400 * 1000
+
+    _SET_IF_VERSION = """
+    if (redis.call('GET', KEYS[2]) or '0') == ARGV[1] then
+        redis.call('SET', KEYS[1], ARGV[2], 'PX', ARGV[3])
+        return 1
+    end
+    return 0
+    """
+
+    def __init__(self, url, prefix='radius-api:usuario:'):
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+        self._set_if_version = self._client.register_script(self._SET_IF_VERSION)
+
+    def get(self, key):
+        raw = self._client.get(self._prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    def version(self, key):
+        raw = self._client.get(self._prefix + 'v:' + key)
+        return raw.decode('ascii') if raw is not None else '0'
+
+    def set(self, key, value, ttl, version):
+        self._set_if_version(keys=[self._prefix + key, self._prefix + 'v:' + key],
+                             args=[version, json.dumps(value), int(ttl * 1000)])
+
+    def invalidate(self, key):
+        pipe = self._client.pipeline()
+        pipe.incr(self._prefix + 'v:' + key)
+        pipe.pexpire(self._prefix + 'v:' + key, self.VERSION_TTL_MS)
+        pipe.delete(self._prefix + key)
+        pipe.execute()
+
+class UserCache:
+    """
+    LRU con TTL thread-safe. Los valores son dicts {'doc': ..., 'etag': ...}.
+    `backend` es cualquier objeto con get(key), version(key), set(key, value, ttl, version)
+    e invalidate(key); si se indica, sustituye a la LRU local (una copia local no se
+    enteraría de las invalidaciones hechas en otros procesos).
+
+    Uso: token = version(key) antes de leer de la base de datos y set(key, value, token)
+    después; el valor se descarta si hubo una invalidación entre medias.
+    """
+
+    def __init__(self, max_size=10000, ttl=30, backend=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # Se incrementa con cada invalidación; evita guardar lecturas que se cruzaron con una escritura
+        self._generation = 0
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0,
+                       'invalidations': 0, 'backend_hits': 0, 'backend_errors': 0}
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_size > 0
+
+    def version(self, key):
+        """Marca de versión para set(); None si no se puede obtener (no se guardará nada)."""
+        if self.backend is None:
+            with self._lock:
+                return self._generation
+        try:
+            return self.backend.version(key)
+        except Exception as e:
+            self._backend_error(e)
+            return None
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        if self.backend is not None:
+            return self._get_shared(key)
+        now = time.monotonic()
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None:
+                expires_at, value = item
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return value
+                del self._entries[key]
+                self._stats['expirations'] += 1
+            self._stats['misses'] += 1
         return None
 
+    def _get_shared(self, key):
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            value = None
+            self._backend_error(e)
+        with self._lock:
+            if value is None:
+                self._stats['misses'] += 1
+                return None
+            self._stats['hits'] += 1
+            self._stats['backend_hits'] += 1
+        return value
+
+    def set(self, key, value, version):
+        """Guarda `value` salvo que haya habido invalidaciones desde que se obtuvo `version`."""
+        if not self.enabled or version is None:
+            return
+        if self.backend is None:
+            with self._lock:
+                if version == self._generation:
+                    self._store_local(key, value)
+            return
+        try:
+            self.backend.set(key, value, self.ttl, version)
+        except Exception as e:
+            self._backend_error(e)
+
+    def _store_local(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self._stats['evictions'] += 1
+
+    def invalidate(self, *keys):
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+            self._stats['invalidations'] += len(keys)
+        if self.backend is not None:
+            for key in keys:
+                try:
+                    self.backend.invalidate(key)
+                except Exception as e:
+                    self._backend_error(e)
+
+    def _backend_error(self, e):
+        with self._lock:
+            self._stats['backend_errors'] += 1
+        app.logger.warning("Error en el backend de caché: %s", e)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({'size': len(self._entries), 'max_size': self.max_size, 'ttl': self.ttl,
+                          'shared_backend': type(self.backend).__name__ if self.backend is not None else None})
+        return stats
+
+user_cache = UserCache(max_size=USER_CACHE_SIZE,
+                       ttl=USER_CACHE_TTL,
+                       backend=RedisCacheBackend(USER_CACHE_REDIS_URL) if USER_CACHE_REDIS_URL else None)
+
+def make_etag(doc):
+    raw = json.dumps(doc, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha1(raw).hexdigest()
+
+# --- Trabajos en segundo plano ---
+# Tareas largas (purgas de radacct) que no deben ejecutarse dentro de una petición.
+# Se guardan en la tabla api_jobs, de modo que su progreso sobrevive a reinicios y
+# cualquier proceso puede reanudarlas. Cada proceso ejecuta un hilo que reclama
+# trabajos pendientes con un UPDATE condicional.
+
+SQL_CREATE_JOBS_TABLE = """
+CREATE TABLE IF NOT EXISTS `api_jobs` (
+  `id` BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+  `kind` VARCHAR(32) NOT NULL,
+  `params` TEXT NOT NULL,
+  `status` VARCHAR(16) NOT NULL DEFAULT 'pending',
+  `attempts` INT NOT NULL DEFAULT 0,
+  `processed` BIGINT UNSIGNED NOT NULL DEFAULT 0,
+  `error` TEXT NULL,
+  `created_at` DATETIME NOT NULL,
+  `started_at` DATETIME NULL,
+  `updated_at` DATETIME NOT NULL,
+  `finished_at` DATETIME NULL,
+  PRIMARY KEY (`id`),
+  KEY `status_updated` (`status`, `updated_at`)
+)
+"""
+
+_jobs_table_ready = False
+
+def ensure_jobs_table(conn):
+    """Crea la tabla api_jobs si no existe. Se llama antes de abrir cualquier transacción (DDL hace commit implícito)."""
+    global _jobs_table_ready
+    if not _jobs_table_ready:
+        with conn.cursor() as cursor:
+            cursor.execute(SQL_CREATE_JOBS_TABLE)
+        _jobs_table_ready = True
+
+def _purge_user_acct_statement(params):
+    # Solo hasta el radacctid máximo al borrar el usuario, por si se vuelve a crear con el mismo nombre
+    return ("DELETE FROM radacct WHERE username = %s AND radacctid <= %s LIMIT %s",
+            [params['username'], params['max_radacctid']])
+
+def _purge_acct_before_statement(params):
+    return ("DELETE FROM radacct WHERE acctstoptime IS NOT NULL AND acctstoptime < %s ORDER BY radacctid LIMIT %s",
+            [params['before']])
+
+# Tipo de trabajo -> función que devuelve el DELETE por bloques y sus parámetros (sin el LIMIT)
+JOB_KINDS = {
+    'purge_user_acct': _purge_user_acct_statement,
+    'purge_acct_before': _purge_acct_before_statement,
+}
+
+def enqueue_job(cursor, kind, params):
+    """Registra un trabajo pendiente dentro de la transacción en curso y devuelve su id."""
+    now = datetime.now()
+    cursor.execute(
+        "INSERT INTO `api_jobs` (`kind`, `params`, `status`, `created_at`, `updated_at`) VALUES (%s, %s, 'pending', %s, %s)",
+        (kind, json.dumps(params, default=str), now, now))
+    return cursor.lastrowid
+
+def _job_row(row):
+    row['params'] = json.loads(row['params'])
+    return row
+
+def claim_next_job():
+    """Reclama el siguiente trabajo pendiente (o abandonado); devuelve None si no hay ninguno."""
+    with db_connection() as conn:
+        ensure_jobs_table(conn)
+        with conn.cursor() as cursor:
+            stale = datetime.fromtimestamp(time.time() - JOBS_STALE_AFTER)
+            cursor.execute(
+                "SELECT id FROM api_jobs WHERE status = 'pending' OR (status = 'running' AND updated_at < %s) "
+                "ORDER BY id LIMIT 1", (stale,))
+            row = cursor.fetchone()
+            if row is None:
+                conn.rollback()
+                return None
+            now = datetime.now()
+            cursor.execute(
+                "UPDATE api_jobs SET status = 'running', attempts = attempts + 1, started_at = COALESCE(started_at, %s), updated_at = %s "
+                "WHERE id = %s AND (status = 'pending' OR (status = 'running' AND updated_at < %s))",
+                (now, now, row['id'], stale))
+            claimed = cursor.rowcount == 1
+            conn.commit()
+            if not claimed:
+                # Otro proceso lo reclamó primero
+                return None
+            cursor.execute("SELECT * FROM api_jobs WHERE id = %s", (row['id'],))
+            job = _job_row(cursor.fetchone())
+        conn.rollback()
+        return job
+
+def run_job(job):
+    """Ejecuta un trabajo de purga por bloques, guardando el progreso en la misma transacción que cada bloque."""
+    app.logger.info("Ejecutando trabajo %s (%s)", job['id'], job['kind'])
+    processed = job['processed']
+    try:
+        sql, args = JOB_KINDS[job['kind']](job['params'])
+        while True:
+            with db_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(sql, args + [ACCT_PURGE_CHUNK_SIZE])
+                    deleted = cursor.rowcount
+                    processed += deleted
+                    cursor.execute("UPDATE api_jobs SET processed = %s, updated_at = %s WHERE id = %s",
+                                   (processed, datetime.now(), job['id']))
+                conn.commit()
+            if deleted < ACCT_PURGE_CHUNK_SIZE:
+                break
+            # Pausa entre bloques para no competir con las escrituras de FreeRADIUS
+            time.sleep(ACCT_PURGE_SLEEP)
+
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                now = datetime.now()
+                cursor.execute("UPDATE api_jobs SET status = 'done', error = NULL, updated_at = %s, finished_at = %s WHERE id = %s",
+                               (now, now, job['id']))
+            conn.commit()
+        app.logger.info("Trabajo %s finalizado: %s filas eliminadas.", job['id'], processed)
+    except (pymysql.MySQLError, DatabaseUnavailableError) as e:
+        app.logger.error("Error en el trabajo %s: %s", job['id'], e)
+        set_job_status(job, 'failed' if job['attempts'] >= JOBS_MAX_ATTEMPTS else 'pending', str(e))
+    except Exception as e:
+        # Tipo desconocido, parámetros inválidos, etc.: reintentar no serviría de nada
+        app.logger.exception("Error inesperado en el trabajo %s", job['id'])
+        set_job_status(job, 'failed', f'{type(e).__name__}: {e}')
+
+def set_job_status(job, status, error):
+    try:
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("UPDATE api_jobs SET status = %s, error = %s, updated_at = %s WHERE id = %s",
+                               (status, error, datetime.now(), job['id']))
+            conn.commit()
+    except (pymysql.MySQLError, DatabaseUnavailableError):
+        # Quedará como 'running' y se reanudará cuando se considere abandonado
+        pass
+
+class JobRunner:
+    """Hilo de fondo que ejecuta los trabajos de api_jobs de uno en uno."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def ensure_started(self):
+        if not JOBS_WORKER_ENABLED:
+            return
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self.run_forever, name='api-jobs', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def notify(self):
+        """Despierta al hilo tras encolar un trabajo."""
+        self._wake.set()
+
+    def run_forever(self):
+        while True:
+            self._wake.clear()
+            try:
+                job = claim_next_job()
+            except (pymysql.MySQLError, DatabaseUnavailableError) as e:
+                app.logger.warning("No se pudieron consultar los trabajos pendientes: %s", e)
+                job = None
+            except Exception:
+                app.logger.exception("Error inesperado al consultar los trabajos pendientes")
+                job = None
+            if job is None:
+                self._wake.wait(JOBS_POLL_INTERVAL)
+                continue
+            run_job(job)
+
+job_runner = JobRunner()
+
+@app.cli.command('jobs-worker')
+def jobs_worker_command():
+    """Ejecuta los trabajos en segundo plano en primer plano (proceso dedicado)."""
+    job_runner.run_forever()
+
+# --- Resúmenes de contabilidad ---
+# El agregador recorre radacct por radacctid desde la última marca procesada y acumula
+# el consumo por usuario y día en api_usage_daily. Las sesiones aún abiertas se anotan
+# en api_rollup_open y se acumulan cuando se cierran (o quedan obsoletas), así una
+# sesión larga no bloquea el avance de la marca. Todo el ciclo ocurre en una
+# transacción que bloquea la fila de estado, por lo que varios procesos no duplican datos.
+# La marca nunca supera safe_radacctid: el MAX(radacctid) observado (horizon_*) hace al
+# menos ROLLUP_SAFETY_LAG segundos, cuando ya se confirmaron los INSERT con ids menores.
+
+SQL_CREATE_ROLLUP_TABLES = (
+    """
+    CREATE TABLE IF NOT EXISTS `api_usage_daily` (
+      `username` VARCHAR(64) NOT NULL,
+      `day` DATE NOT NULL,
+      `sessions` INT UNSIGNED NOT NULL DEFAULT 0,
+      `session_time` BIGINT UNSIGNED NOT NULL DEFAULT 0,
+      `input_octets` BIGINT UNSIGNED NOT NULL DEFAULT 0,
+      `output_octets` BIGINT UNSIGNED NOT NULL DEFAULT 0,
+      PRIMARY KEY (`username`, `day`)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS `api_rollup_open` (
+      `radacctid` BIGINT UNSIGNED NOT NULL,
+      PRIMARY KEY (`radacctid`)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS `api_rollup_state` (
+      `name` VARCHAR(32) NOT NULL,
+      `last_radacctid` BIGINT UNSIGNED NOT NULL DEFAULT 0,
+      `safe_radacctid` BIGINT UNSIGNED NOT NULL DEFAULT 0,
+      `horizon_radacctid` BIGINT UNSIGNED NULL,
+      `horizon_at` DATETIME NULL,
+      `updated_at` DATETIME NULL,
+      PRIMARY KEY (`name`)
+    )
+    """,
+    "INSERT IGNORE INTO `api_rollup_state` (`name`, `last_radacctid`) VALUES ('usage', 0)",
+)
+
+# Sesión abierta y con actualizaciones recientes (nunca NULL, para poder negarla)
+# `{t}` es el prefijo de tabla opcional ('r.' cuando se usa en un JOIN)
+SQL_OPEN_SESSION = "({t}acctstoptime IS NULL AND COALESCE({t}acctupdatetime, {t}acctstarttime, '1970-01-01') >= %s)"
+
+SQL_USAGE_GROUPS = (
+    "SELECT username, DATE(COALESCE(acctstarttime, acctupdatetime, acctstoptime)) AS day, COUNT(*) AS sessions, "
+    "COALESCE(SUM(acctsessiontime), 0) AS session_time, COALESCE(SUM(acctinputoctets), 0) AS input_octets, "
+    "COALESCE(SUM(acctoutputoctets), 0) AS output_octets FROM radacct WHERE {where} GROUP BY username, day"
+)
+
+SQL_UPSERT_USAGE = (
+    "INSERT INTO `api_usage_daily` (`username`, `day`, `sessions`, `session_time`, `input_octets`, `output_octets`) "
+    "VALUES (%s, %s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE sessions = sessions + VALUES(sessions), "
+    "session_time = session_time + VALUES(session_time), input_octets = input_octets + VALUES(input_octets), "
+    "output_octets = output_octets + VALUES(output_octets)"
+)
+
+_rollup_tables_ready = False
+
+def ensure_rollup_tables(conn):
+    """Crea las tablas de resúmenes si no existen (fuera de cualquier transacción)."""
+    global _rollup_tables_ready
+    if not _rollup_tables_ready:
+        with conn.cursor() as cursor:
+            for sql in SQL_CREATE_ROLLUP_TABLES:
+                cursor.execute(sql)
+        conn.commit()
+        _rollup_tables_ready = True
+
+def rollup_usage_batch():
+    """
+    Procesa un lote de radacct. Devuelve el número de filas nuevas recorridas
+    (0 cuando el resumen está al día).
+    """
+    with db_connection() as conn:
+        ensure_rollup_tables(conn)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT last_radacctid, safe_radacctid, horizon_radacctid, horizon_at "
+                               "FROM api_rollup_state WHERE name = 'usage' FOR UPDATE")
+                state = cursor.fetchone()
+                last_id = state['last_radacctid']
+                safe_id = state['safe_radacctid']
+                horizon_id, horizon_at = state['horizon_radacctid'], state['horizon_at']
+                if isinstance(horizon_at, str):
+                    horizon_at = datetime.fromisoformat(horizon_at)
+                now = datetime.now()
+                if horizon_at is None or (now - horizon_at).total_seconds() >= ROLLUP_SAFETY_LAG:
+                    # El horizonte anterior ya es seguro; se toma uno nuevo
+                    if horizon_id is not None:
+                        safe_id = max(safe_id, horizon_id)
+                    cursor.execute("SELECT MAX(radacctid) AS max_id FROM radacct")
+                    horizon_id, horizon_at = cursor.fetchone()['max_id'] or 0, now
+                upper = min(safe_id, last_id + ROLLUP_BATCH_SIZE)
+                stale = now - timedelta(seconds=ROLLUP_STALE_AFTER)
+                groups = []
+
+                # 1. Sesiones anotadas como abiertas que ya se cerraron, quedaron obsoletas o se purgaron
+                cursor.execute(
+                    "SELECT o.radacctid, r.radacctid AS present FROM api_rollup_open o "
+                    "LEFT JOIN radacct r ON r.radacctid = o.radacctid "
+                    f"WHERE r.radacctid IS NULL OR NOT {SQL_OPEN_SESSION.format(t='r.')}", (stale,))
+                finished = cursor.fetchall()
+                closed_ids = [row['radacctid'] for row in finished if row['present'] is not None]
+                if closed_ids:
+                    placeholders = ', '.join(['%s'] * len(closed_ids))
+                    cursor.execute(SQL_USAGE_GROUPS.format(where=f"radacctid IN ({placeholders})"), closed_ids)
+                    groups.extend(cursor.fetchall())
+                if finished:
+                    cursor.executemany("DELETE FROM api_rollup_open WHERE radacctid = %s",
+                                       [(row['radacctid'],) for row in finished])
+
+                # 2. Filas nuevas desde la marca: las abiertas se anotan, el resto se acumula
+                if upper > last_id:
+                    cursor.execute(
+                        f"SELECT radacctid FROM radacct WHERE radacctid > %s AND radacctid <= %s AND {SQL_OPEN_SESSION.format(t='')}",
+                        (last_id, upper, stale))
+                    open_rows = cursor.fetchall()
+                    if open_rows:
+                        cursor.executemany("INSERT IGNORE INTO api_rollup_open (radacctid) VALUES (%s)",
+                                           [(row['radacctid'],) for row in open_rows])
+                    cursor.execute(
+                        SQL_USAGE_GROUPS.format(where=f"radacctid > %s AND radacctid <= %s AND NOT {SQL_OPEN_SESSION.format(t='')}"),
+                        (last_id, upper, stale))
+                    groups.extend(cursor.fetchall())
+
+                rows = [(g['username'], g['day'], g['sessions'], g['session_time'], g['input_octets'], g['output_octets'])
+                        for g in groups if g['username'] is not None and g['day'] is not None]
+                if rows:
+                    cursor.executemany(SQL_UPSERT_USAGE, rows)
+                cursor.execute("UPDATE api_rollup_state SET last_radacctid = %s, safe_radacctid = %s, "
+                               "horizon_radacctid = %s, horizon_at = %s, updated_at = %s WHERE name = 'usage'",
+                               (max(upper, last_id), safe_id, horizon_id, horizon_at, datetime.now()))
+            conn.commit()
+            return max(upper - last_id, 0)
+        except pymysql.MySQLError:
+            conn.rollback()
+            raise
+
+def rollup_usage():
+    """Ejecuta lotes hasta que el resumen alcanza el final de radacct."""
+    total = 0
+    while True:
+        processed = rollup_usage_batch()
+        total += processed
+        if processed < ROLLUP_BATCH_SIZE:
+            return total
+        # Pausa entre lotes para no competir con las escrituras de FreeRADIUS en radacct
+        time.sleep(ROLLUP_BATCH_SLEEP)
+
+def get_rollup_freshness(cursor):
+    cursor.execute("SELECT last_radacctid, updated_at FROM api_rollup_state WHERE name = 'usage'")
+    state = cursor.fetchone() or {'last_radacctid': 0, 'updated_at': None}
+    updated_at = state['updated_at']
+    if isinstance(updated_at, str):
+        updated_at = datetime.fromisoformat(updated_at)
+    return {
+        'last_radacctid': state['last_radacctid'],
+        'updated_at': updated_at.isoformat() if updated_at else None,
+        'age_seconds': round((datetime.now() - updated_at).total_seconds(), 1) if updated_at else None,
+    }
+
+class UsageAggregator:
+    """Hilo de fondo que actualiza los resúmenes de contabilidad cada ROLLUP_INTERVAL segundos."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def ensure_started(self):
+        if not ROLLUP_ENABLED:
+            return
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self.run_forever, name='usage-rollup', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def run_forever(self):
+        while True:
+            try:
+                processed = rollup_usage()
+                if processed:
+                    app.logger.info("Resumen de contabilidad actualizado: %s filas de radacct procesadas.", processed)
+            except (pymysql.MySQLError, DatabaseUnavailableError) as e:
+                app.logger.warning("No se pudo actualizar el resumen de contabilidad: %s", e)
+            except Exception:
+                # Un error inesperado no debe matar el hilo; se reintenta en el siguiente ciclo
+                app.logger.exception("Error inesperado al actualizar el resumen de contabilidad")
+            time.sleep(ROLLUP_INTERVAL)
+
+usage_aggregator = UsageAggregator()
+
+@app.cli.command('rollup-usage')
+def rollup_usage_command():
+    """Actualiza una vez los resúmenes de contabilidad hasta el final de radacct."""
+    print(f"{rollup_usage()} filas de radacct procesadas.")
+
+@app.before_request
+def start_background_threads():
+    # Se arrancan en la primera petición de cada proceso (tras el fork de gunicorn)
+    job_runner.ensure_started()
+    usage_aggregator.ensure_started()
+
+# --- Utilidades para el alta de usuarios ---
+
+# Todas las columnas como marcadores para que executemany() genere INSERTs multi-fila
+SQL_INSERT_USERINFO = "INSERT INTO `userinfo` (`username`, `firstname`, `lastname`, `email`, `creationdate`, `creationby`) VALUES (%s, %s, %s, %s, %s, %s)"
+SQL_INSERT_RADCHECK = "INSERT INTO `radcheck` (`username`, `attribute`, `op`, `value`) VALUES (%s, %s, %s, %s)"
+SQL_INSERT_RADREPLY = "INSERT INTO `radreply` (`username`, `attribute`, `op`, `value`) VALUES (%s, %s, %s, %s)"
+SQL_INSERT_RADUSERGROUP = "INSERT INTO `radusergroup` (`username`, `groupname`, `priority`) VALUES (%s, %s, %s)"
+
+def parse_new_user(data):
+    """
+    Valida el cuerpo de un alta de usuario y lo normaliza.
+    Lanza ValueError con el motivo si la fila no es válida.
+    """
+    if not isinstance(data, dict) or not data.get('username') or not data.get('password'):
+        raise ValueError('Se requieren nombre de usuario y contraseña')
+    if not isinstance(data['username'], str) or not isinstance(data['password'], str):
+        raise ValueError('El nombre de usuario y la contraseña deben ser texto')
+    if len(data['username']) > 64:
+        raise ValueError('El nombre de usuario no puede superar 64 caracteres')
+    if data.get('plan') is not None:
+        validate_plan_name(data['plan'])
+    return {
+        # Datos para FreeRADIUS
+        'username': data['username'],
+        'password': data['password'],
+        'simultaneous_use': data.get('simultaneous_use'),
+        'session_timeout': data.get('session_timeout'),
+        # Plan de servicio (grupo de radusergroup); no se admiten valores individuales
+        # para los atributos que el plan ya define (ver plan_conflicts)
+        'plan': data.get('plan'),
+        # Datos opcionales para daloRADIUS (userinfo)
+        'firstname': data.get('firstname', ''),
+        'lastname': data.get('lastname', ''),
+        'email': data.get('email', ''),
+    }
+
+def insert_users(cursor, users):
+    """Inserta usuarios ya validados en userinfo, radcheck, radreply y radusergroup con INSERTs multi-fila."""
+    now = datetime.now()
+    cursor.executemany(SQL_INSERT_USERINFO, [
+        (u['username'], u['firstname'], u['lastname'], u['email'], now, 'api') for u in users
+    ])
+
+    check_rows = []
+    reply_rows = []
+    for u in users:
+        check_rows.append((u['username'], 'Cleartext-Password', ':=', u['password']))
+        if u['simultaneous_use'] is not None:
+            check_rows.append((u['username'], 'Simultaneous-Use', ':=', str(u['simultaneous_use'])))
+        if u['session_timeout'] is not None:
+            reply_rows.append((u['username'], 'Session-Timeout', ':=', str(u['session_timeout'])))
+
+    cursor.executemany(SQL_INSERT_RADCHECK, check_rows)
+    if reply_rows:
+        cursor.executemany(SQL_INSERT_RADREPLY, reply_rows)
+    group_rows = [(u['username'], plan_group(u['plan']), PLAN_PRIORITY) for u in users if u['plan'] is not None]
+    if group_rows:
+        cursor.executemany(SQL_INSERT_RADUSERGROUP, group_rows)
+
+def find_existing_usernames(cursor, usernames):
+    """Devuelve el subconjunto de `usernames` que ya existe en userinfo o radcheck."""
+    if not usernames:
+        return set()
+    placeholders = ', '.join(['%s'] * len(usernames))
+    cursor.execute(
+        f"SELECT username FROM userinfo WHERE username IN ({placeholders}) "
+        f"UNION SELECT username FROM radcheck WHERE username IN ({placeholders}) AND attribute = 'Cleartext-Password'",
+        list(usernames) * 2)
+    return {row['username'] for row in cursor.fetchall()}
+
+def touch_users(cursor, usernames):
+    """Marca userinfo.updatedate de los usuarios cuyos atributos de RADIUS cambiaron."""
+    placeholders = ', '.join(['%s'] * len(usernames))
+    cursor.execute(f"UPDATE userinfo SET updatedate = %s, updateby = 'api' WHERE username IN ({placeholders})",
+                   [datetime.now()] + list(usernames))
+
+# --- Planes de servicio ---
+# Un plan es un perfil de daloRADIUS: un grupo con filas en radgroupcheck/radgroupreply
+# al que se asocian los usuarios mediante radusergroup. Cambiar un plan actualiza solo
+# las filas del grupo, sin tocar las de cada usuario. El grupo se llama
+# PLAN_GROUP_PREFIX + nombre del plan, de modo que los demás grupos de FreeRADIUS
+# nunca se listan ni se modifican como planes.
+
+PLAN_OPERATORS = ('=', ':=', '==', '+=', '!=', '>', '>=', '<', '<=', '=~', '!~', '=*', '!*')
+
+# Atributos individuales que se pueden dar al crear o modificar un usuario
+USER_PLAN_ATTRIBUTES = (('simultaneous_use', 'check_attributes', 'Simultaneous-Use'),
+                        ('session_timeout', 'reply_attributes', 'Session-Timeout'))
+
+def validate_plan_name(name):
+    max_length = 64 - len(PLAN_GROUP_PREFIX)
+    if not isinstance(name, str) or not name or len(name) > max_length:
+        raise ValueError(f'El nombre del plan debe ser texto de 1 a {max_length} caracteres')
+
+def plan_group(name):
+    """Nombre del grupo de FreeRADIUS que respalda el plan."""
+    return PLAN_GROUP_PREFIX + name
+
+def _plan_group_like():
+    escaped = PLAN_GROUP_PREFIX.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return escaped + '%'
+
+def plan_conflicts(plan, data):
+    """Atributos que el plan ya define y para los que `data` trae un valor individual."""
+    defined = {key: {attr['attribute'] for attr in plan[key]} for key in ('check_attributes', 'reply_attributes')}
+    return [attribute for field, key, attribute in USER_PLAN_ATTRIBUTES
+            if data.get(field) is not None and attribute in defined[key]]
+
+def plan_conflict_error(plan, conflicts):
+    return f"El plan {plan['name']} ya define {', '.join(conflicts)}; no se admite un valor individual"
+
+def parse_plan_attributes(data):
+    """
+    Convierte el cuerpo de un plan en dos dicts {atributo: (op, valor) o None}, para
+    radgroupcheck y radgroupreply. None significa eliminar el atributo. Admite los atajos
+    simultaneous_use y session_timeout y listas check_attributes/reply_attributes.
+    """
+    check = {}
+    reply = {}
+    if 'simultaneous_use' in data:
+        value = data['simultaneous_use']
+        check['Simultaneous-Use'] = None if value is None else (':=', str(value))
+    if 'session_timeout' in data:
+        value = data['session_timeout']
+        reply['Session-Timeout'] = None if value is None else (':=', str(value))
+    for key, target in (('check_attributes', check), ('reply_attributes', reply)):
+        items = data.get(key) or []
+        if not isinstance(items, list):
+            raise ValueError(f'{key} debe ser una lista')
+        for item in items:
+            if not isinstance(item, dict) or not isinstance(item.get('attribute'), str) or not item['attribute']:
+                raise ValueError(f'Cada elemento de {key} requiere attribute')
+            op = item.get('op', ':=')
+            if op not in PLAN_OPERATORS:
+                raise ValueError(f'Operador no válido: {op}')
+            value = item.get('value')
+            target[item['attribute']] = None if value is None else (op, str(value))
+    return check, reply
+
+def write_plan_attributes(cursor, name, check, reply):
+    """Reemplaza en bloque los atributos indicados del grupo (una sentencia por tabla y operación)."""
+    name = plan_group(name)
+    for table, attrs in (('radgroupcheck', check), ('radgroupreply', reply)):
+        if not attrs:
+            continue
+        cursor.executemany(f"DELETE FROM `{table}` WHERE groupname = %s AND attribute = %s",
+                           [(name, attribute) for attribute in attrs])
+        rows = [(name, attribute, op_value[0], op_value[1]) for attribute, op_value in attrs.items() if op_value is not None]
+        if rows:
+            cursor.executemany(f"INSERT INTO `{table}` (`groupname`, `attribute`, `op`, `value`) VALUES (%s, %s, %s, %s)", rows)
+
+def load_plans(cursor, names=None):
+    """Devuelve {nombre: plan} con sus atributos; si `names` se indica, solo esos planes."""
+    if names is not None and not names:
+        return {}
+    if names is None:
+        where = " WHERE groupname LIKE %s"
+        params = [_plan_group_like()]
+    else:
+        params = [plan_group(name) for name in names]
+        where = f" WHERE groupname IN ({', '.join(['%s'] * len(params))})"
+    plans = {}
+    for table, key in (('radgroupcheck', 'check_attributes'), ('radgroupreply', 'reply_attributes')):
+        cursor.execute(f"SELECT groupname, attribute, op, value FROM `{table}`{where} ORDER BY groupname, id", params)
+        for row in cursor.fetchall():
+            group = row.pop('groupname')
+            name = group[len(PLAN_GROUP_PREFIX):]
+            plan = plans.setdefault(name, {'name': name, 'group': group,
+                                           'check_attributes': [], 'reply_attributes': []})
+            plan[key].append(row)
+    return plans
+
+def unassign_plans(cursor, usernames):
+    """Quita a los usuarios de cualquier plan; los grupos que no son planes no se tocan."""
+    placeholders = ', '.join(['%s'] * len(usernames))
+    cursor.execute(
+        f"DELETE FROM radusergroup WHERE username IN ({placeholders}) AND groupname LIKE %s",
+        list(usernames) + [_plan_group_like()])
+
+def plan_attribute_names(plan):
+    """Atributos por tabla de usuario (radcheck/radreply) que el plan define."""
+    return [(table, sorted({attr['attribute'] for attr in plan[key]} - {'Cleartext-Password'}))
+            for table, key in (('radcheck', 'check_attributes'), ('radreply', 'reply_attributes'))]
+
+def assign_plan(cursor, plan, usernames):
+    """
+    Mueve a los usuarios al plan con sentencias por conjunto: los saca de su plan anterior,
+    los asocia al nuevo y elimina sus atributos individuales que el plan ya define.
+    """
+    unassign_plans(cursor, usernames)
+    cursor.executemany(SQL_INSERT_RADUSERGROUP, [(username, plan['group'], PLAN_PRIORITY) for username in usernames])
+    touch_users(cursor, usernames)
+    placeholders = ', '.join(['%s'] * len(usernames))
+    for table, attributes in plan_attribute_names(plan):
+        if attributes:
+            cursor.execute(
+                f"DELETE FROM `{table}` WHERE username IN ({placeholders}) "
+                f"AND attribute IN ({', '.join(['%s'] * len(attributes))})",
+                list(usernames) + attributes)
+
+def iter_bulk_rows():
+    """
+    Devuelve un iterador sobre las filas del cuerpo de POST /usuarios/bulk.
+    Admite un array JSON o NDJSON (una fila por línea, leído de forma incremental).
+    Cada elemento es (fila, error_de_parseo). Lanza ValueError si el cuerpo no es válido.
+    """
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        return _iter_ndjson(_ndjson_lines(request.stream))
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, list):
+        raise ValueError('Se esperaba un array JSON o un cuerpo NDJSON')
+    return ((row, None) for row in data)
+
+def _ndjson_lines(stream):
+    """
+    Itera las líneas del cuerpo. LimitedStream de Werkzeug (io.RawIOBase) no tiene búfer y
+    se envuelve en un BufferedReader; con wsgi.input_terminated (gunicorn) llega el objeto
+    de entrada del servidor, que ya tiene búfer pero no implementa readinto().
+    """
+    if isinstance(stream, io.RawIOBase):
+        return io.BufferedReader(stream)
+    return iter(stream.readline, b'')
+
+def _iter_ndjson(lines):
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line), None
+        except ValueError as e:
+            yield None, f'JSON inválido: {e}'
+
 # --- Endpoints de la API ---
 
 @app.route('/usuarios', methods=['POST'])
@@ -64,244 +1525,1019 @@ def create_user():
     """
     Crea un nuevo usuario con sus atributos, asegurando la visibilidad en daloRADIUS.
     Requiere: username, password.
-    Opcional: firstname, lastname, email, simultaneous_use, session_timeout.
+    Opcional: firstname, lastname, email, simultaneous_use, session_timeout, plan.
     """
     app.logger.info("Recibida petición POST en /usuarios")
-    data = request.get_json()
-    if not data or not 'username' in data or not 'password' in data:
-        app.logger.warning("Petición POST inválida: faltan username o password.")
-        return jsonify({'error': 'Se requieren nombre de usuario y contraseña'}), 400
-
-    # Datos para FreeRADIUS
-    username = data['username']
-    password = data['password']
-    simultaneous_use = data.get('simultaneous_use')
-    session_timeout = data.get('session_timeout')
-
-    # Datos opcionales para daloRADIUS (userinfo)
-    firstname = data.get('firstname', '')
-    lastname = data.get('lastname', '')
-    email = data.get('email', '')
-
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({'error': 'No se pudo conectar a la base de datos'}), 500
-    
     try:
+        user = parse_new_user(request.get_json(silent=True))
+    except ValueError as e:
+        app.logger.warning("Petición POST inválida: %s", e)
+        return jsonify({'error': str(e)}), 400
+    username = user['username']
+
+    with db_connection() as conn:
+        try:
+            with conn.cursor() as cursor:
+                if user['plan'] is not None:
+                    plan = load_plans(cursor, {user['plan']}).get(user['plan'])
+                    if plan is None:
+                        return jsonify({'error': f"El plan {user['plan']} no existe"}), 400
+                    conflicts = plan_conflicts(plan, user)
+                    if conflicts:
+                        return jsonify({'error': plan_conflict_error(plan, conflicts)}), 400
+                app.logger.info("Insertando usuario %s en la base de datos.", username)
+                insert_users(cursor, [user])
+
+            conn.commit()
+            user_cache.invalidate(username)
+            app.logger.info("Usuario %s creado exitosamente.", username)
+            return jsonify({'success': f'Usuario {username} creado correctamente'}), 201
+        except pymysql.MySQLError as e:
+            app.logger.error("Error de base de datos al crear usuario %s: %s", username, e)
+            conn.rollback()
+            return jsonify({'error': f'Error de base de datos: {e}'}), 500
+
+def _write_bulk_chunk(chunk, results):
+    """
+    Escribe un bloque de filas válidas en una sola transacción.
+    Si el bloque falla se reintenta fila a fila para aislar las filas problemáticas.
+    La conexión se toma del pool solo durante el bloque, no mientras se lee el cuerpo.
+    """
+    with db_connection() as conn:
         with conn.cursor() as cursor:
-            app.logger.info(f"Insertando usuario {username} en la base de datos.")
-            
-            # --- INSERCIÓN PARA DALORADIUS (en la tabla userinfo) ---
-            sql_user_dalo = "INSERT INTO `userinfo` (`username`, `firstname`, `lastname`, `email`, `creationdate`, `creationby`) VALUES (%s, %s, %s, %s, %s, %s)"
-            cursor.execute(sql_user_dalo, (username, firstname, lastname, email, datetime.now(), 'api'))
-            
-            # --- Inserciones para FreeRADIUS ---
-            sql_pass = "INSERT INTO `radcheck` (`username`, `attribute`, `op`, `value`) VALUES (%s, 'Cleartext-Password', ':=', %s)"
-            cursor.execute(sql_pass, (username, password))
-
-            if simultaneous_use is not None:
-                sql_simul = "INSERT INTO `radcheck` (`username`, `attribute`, `op`, `value`) VALUES (%s, 'Simultaneous-Use', ':=', %s)"
-                cursor.execute(sql_simul, (username, str(simultaneous_use)))
-
-            if session_timeout is not None:
-                sql_timeout = "INSERT INTO `radreply` (`username`, `attribute`, `op`, `value`) VALUES (%s, 'Session-Timeout', ':=', %s)"
-                cursor.execute(sql_timeout, (username, str(session_timeout)))
+            existing = find_existing_usernames(cursor, [user['username'] for _, user in chunk])
+            plans = load_plans(cursor, {user['plan'] for _, user in chunk if user['plan'] is not None})
+        pending = []
+        for index, user in chunk:
+            if user['username'] in existing:
+                results.append({'index': index, 'username': user['username'], 'status': 'error',
+                                'error': 'El usuario ya existe'})
+            elif user['plan'] is not None and user['plan'] not in plans:
+                results.append({'index': index, 'username': user['username'], 'status': 'error',
+                                'error': f"El plan {user['plan']} no existe"})
+            elif user['plan'] is not None and plan_conflicts(plans[user['plan']], user):
+                plan = plans[user['plan']]
+                results.append({'index': index, 'username': user['username'], 'status': 'error',
+                                'error': plan_conflict_error(plan, plan_conflicts(plan, user))})
+            else:
+                pending.append((index, user))
+        if not pending:
+            conn.rollback()
+            return
 
-        conn.commit()
-        app.logger.info(f"Usuario {username} creado exitosamente.")
-        return jsonify({'success': f'Usuario {username} creado correctamente'}), 201
-    except pymysql.MySQLError as e:
-        app.logger.error(f"Error de base de datos al crear usuario {username}: {e}")
-        conn.rollback()
-        return jsonify({'error': f'Error de base de datos: {e}'}), 500
-    finally:
-        if conn:
-            conn.close()
-            app.logger.info("Conexión a la base de datos cerrada.")
+        try:
+            with conn.cursor() as cursor:
+                insert_users(cursor, [user for _, user in pending])
+            conn.commit()
+            user_cache.invalidate(*(user['username'] for _, user in pending))
+            results.extend({'index': index, 'username': user['username'], 'status': 'created'}
+                           for index, user in pending)
+            return
+        except pymysql.MySQLError as e:
+            conn.rollback()
+            app.logger.warning("Falló el bloque de alta masiva (%s filas), reintentando fila a fila: %s", len(pending), e)
+
+        for index, user in pending:
+            try:
+                with conn.cursor() as cursor:
+                    insert_users(cursor, [user])
+                conn.commit()
+                user_cache.invalidate(user['username'])
+                results.append({'index': index, 'username': user['username'], 'status': 'created'})
+            except pymysql.MySQLError as e:
+                conn.rollback()
+                results.append({'index': index, 'username': user['username'], 'status': 'error',
+                                'error': f'Error de base de datos: {e}'})
+
+@app.route('/usuarios/bulk', methods=['POST'])
+@require_api_key
+def bulk_create_users():
+    """
+    Crea usuarios en lote a partir de un array JSON o de un cuerpo NDJSON
+    (Content-Type: application/x-ndjson). Cada fila admite los mismos campos que POST /usuarios.
+    Las filas se validan a medida que se leen y se insertan en bloques de `chunk_size`,
+    una transacción por bloque. Las filas duplicadas o inválidas se reportan sin abortar el lote.
+    """
+    app.logger.info("Recibida petición POST en /usuarios/bulk")
+    chunk_size = request.args.get('chunk_size', BULK_CHUNK_SIZE, type=int)
+    if chunk_size is None or not 1 <= chunk_size <= BULK_MAX_CHUNK_SIZE:
+        return jsonify({'error': f'chunk_size debe estar entre 1 y {BULK_MAX_CHUNK_SIZE}'}), 400
+
+    try:
+        rows = iter_bulk_rows()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    results = []
+    seen = set()
+    chunk = []
+    total = 0
+    for index, (data, parse_error) in enumerate(rows):
+        total += 1
+        try:
+            if parse_error:
+                raise ValueError(parse_error)
+            user = parse_new_user(data)
+            if user['username'] in seen:
+                raise ValueError('Usuario duplicado dentro del lote')
+        except ValueError as e:
+            username = data.get('username') if isinstance(data, dict) else None
+            results.append({'index': index, 'username': username, 'status': 'error', 'error': str(e)})
+            continue
+        seen.add(user['username'])
+        chunk.append((index, user))
+        if len(chunk) >= chunk_size:
+            _write_bulk_chunk(chunk, results)
+            chunk = []
+    if chunk:
+        _write_bulk_chunk(chunk, results)
+
+    results.sort(key=lambda r: r['index'])
+    created = sum(1 for r in results if r['status'] == 'created')
+    app.logger.info("Alta masiva finalizada: %s de %s usuarios creados.", created, total)
+    return jsonify({
+        'total': total,
+        'created': created,
+        'failed': total - created,
+        'results': results
+    })
+
+def encode_users_cursor(row):
+    """Codifica la posición (username, id) de la última fila devuelta como cursor opaco."""
+    raw = json.dumps([row['username'], row['id']]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_users_cursor(cursor):
+    try:
+        username, user_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return str(username), int(user_id)
+    except (ValueError, TypeError):
+        raise ValueError('Cursor de paginación inválido')
+
+def build_users_filter(args):
+    """
+    Construye la cláusula WHERE del listado de usuarios a partir de los parámetros
+    `after`, `prefix`, `email`, `created_from` y `created_to`. Lanza ValueError si alguno es inválido.
+    """
+    conditions = []
+    params = []
+    if args.get('after'):
+        username, user_id = decode_users_cursor(args['after'])
+        # Keyset sobre (username, id): usa el índice de username en lugar de OFFSET
+        conditions.append("(username > %s OR (username = %s AND id > %s))")
+        params.extend([username, username, user_id])
+    if args.get('prefix'):
+        escaped = args['prefix'].replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        conditions.append("username LIKE %s")
+        params.append(escaped + '%')
+    if args.get('email'):
+        conditions.append("email = %s")
+        params.append(args['email'])
+    for name, op in (('created_from', '>='), ('created_to', '<')):
+        if args.get(name):
+            try:
+                value = datetime.fromisoformat(args[name])
+            except ValueError:
+                raise ValueError(f'{name} debe ser una fecha ISO 8601')
+            conditions.append(f"creationdate {op} %s")
+            params.append(value)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    return where, params
+
+def stream_users(where, params):
+    """
+    Genera un array JSON con todos los usuarios que cumplen el filtro usando un cursor
+    del lado del servidor (SSDictCursor), de modo que la memoria no crece con la tabla.
+    """
+    with db_connection() as conn:
+        # Sin `with` para el cursor: si el cliente corta la descarga no se leen las filas
+        # restantes; la conexión se descarta al salir con excepción.
+        cursor = conn.cursor(TimedSSDictCursor)
+        cursor.execute(
+            "SELECT id, username, firstname, lastname, email, creationdate FROM userinfo"
+            f"{where} ORDER BY username, id", params)
+        yield '['
+        first = True
+        for row in cursor:
+            row.pop('id')
+            yield ('' if first else ',') + app.json.dumps(row)
+            first = False
+        yield ']'
+        cursor.close()
 
 @app.route('/usuarios', methods=['GET'])
 @require_api_key
 def get_all_users():
-    """Obtiene una lista de todos los usuarios de la tabla userinfo."""
+    """
+    Lista usuarios de la tabla userinfo paginando por keyset sobre (username, id).
+    Parámetros: limit, after (cursor), prefix, email, created_from, created_to.
+    El cursor de la página siguiente se devuelve en el encabezado X-Next-Cursor.
+    Con stream=1 se devuelven todos los usuarios filtrados en una respuesta en streaming.
+    """
     app.logger.info("Recibida petición GET para /usuarios (todos)")
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({'error': 'No se pudo conectar a la base de datos'}), 500
-        
     try:
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT username, firstname, lastname, email, creationdate FROM userinfo")
-            users = cursor.fetchall()
-            return jsonify(users)
+        where, params = build_users_filter(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if request.args.get('stream') in ('1', 'true'):
+        # Se avanza hasta el primer fragmento para que los errores de conexión o de
+        # consulta se reporten con su código HTTP antes de empezar a enviar el cuerpo.
+        stream = stream_users(where, params)
+        try:
+            head = next(stream)
+        except pymysql.MySQLError as e:
+            app.logger.error("Error de base de datos al obtener todos los usuarios: %s", e)
+            return jsonify({'error': f'Error de base de datos: {e}'}), 500
+        return Response(itertools.chain([head], stream), mimetype='application/json')
+
+    limit = request.args.get('limit', USERS_PAGE_SIZE, type=int)
+    if limit is None or not 1 <= limit <= USERS_MAX_PAGE_SIZE:
+        return jsonify({'error': f'limit debe estar entre 1 y {USERS_MAX_PAGE_SIZE}'}), 400
+
+    with db_connection() as conn:
+        try:
+            with conn.cursor() as cursor:
+                # Se pide una fila extra para saber si existe una página siguiente
+                cursor.execute(
+                    "SELECT id, username, firstname, lastname, email, creationdate FROM userinfo"
+                    f"{where} ORDER BY username, id LIMIT %s", params + [limit + 1])
+                users = cursor.fetchall()
+        except pymysql.MySQLError as e:
+            app.logger.error("Error de base de datos al obtener todos los usuarios: %s", e)
+            return jsonify({'error': f'Error de base de datos: {e}'}), 500
+
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        next_cursor = encode_users_cursor(users[-1])
+    for user in users:
+        user.pop('id')
+
+    response = jsonify(users)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+        next_args = request.args.to_dict()
+        next_args.update({'after': next_cursor, 'limit': limit})
+        response.headers['Link'] = f'<{url_for("get_all_users", **next_args)}>; rel="next"'
+    return response
+
+# Una sola consulta ordenada sobre las tres tablas; `src` (0 userinfo, 1 radcheck, 2 radreply)
+# deja los datos de userinfo primero dentro de cada usuario. El orden binario evita que
+# nombres que solo difieren en mayúsculas se intercalen con la intercalación por defecto.
+SQL_EXPORT_USERS = """
+SELECT CAST(username AS BINARY) AS sort_key, username, 0 AS src, NULL AS attribute, NULL AS op, NULL AS value,
+       firstname, lastname, email, creationdate, updatedate
+  FROM userinfo{info_where}
+UNION ALL
+SELECT CAST(username AS BINARY), username, 1, attribute, op, value, NULL, NULL, NULL, NULL, NULL
+  FROM radcheck{attr_where}
+UNION ALL
+SELECT CAST(username AS BINARY), username, 2, attribute, op, value, NULL, NULL, NULL, NULL, NULL
+  FROM radreply{attr_where}
+ORDER BY sort_key, src
+"""
+
+EXPORT_CSV_FIELDS = ('username', 'firstname', 'lastname', 'email', 'creationdate', 'updatedate',
+                     'check_attributes', 'reply_attributes')
+
+def iter_export_records(changed_since=None):
+    """
+    Genera un registro combinado por usuario a partir de una única pasada con cursor del
+    lado del servidor. Solo se mantiene en memoria el usuario en curso.
+    """
+    info_where = attr_where = ""
+    params = []
+    if changed_since is not None:
+        changed = "(creationdate >= %s OR updatedate >= %s)"
+        info_where = f" WHERE {changed}"
+        attr_where = f" WHERE username IN (SELECT username FROM userinfo WHERE {changed})"
+        params = [changed_since] * 6
+
+    with db_connection() as conn:
+        # Sin `with` para el cursor: ver stream_users
+        cursor = conn.cursor(TimedSSDictCursor)
+        cursor.execute(SQL_EXPORT_USERS.format(info_where=info_where, attr_where=attr_where), params)
+        yield None  # Consulta lanzada: los errores ya se habrían producido
+        record = None
+        for row in cursor:
+            if record is None or row['username'] != record['username']:
+                if record is not None:
+                    yield record
+                record = {'username': row['username'], 'firstname': None, 'lastname': None, 'email': None,
+                          'creationdate': None, 'updatedate': None, 'check_attributes': [], 'reply_attributes': []}
+            if row['src'] == 0:
+                for field in ('firstname', 'lastname', 'email', 'creationdate', 'updatedate'):
+                    record[field] = row[field]
+            else:
+                key = 'check_attributes' if row['src'] == 1 else 'reply_attributes'
+                record[key].append({'attribute': row['attribute'], 'op': row['op'], 'value': row['value']})
+        if record is not None:
+            yield record
+        cursor.close()
+
+def _export_value(value):
+    return value.isoformat(sep=' ') if isinstance(value, datetime) else value
+
+def encode_export(records, fmt):
+    """Serializa los registros como NDJSON o CSV en fragmentos de unos EXPORT_CHUNK_BYTES."""
+    buffer = io.StringIO()
+    writer = None
+    if fmt == 'csv':
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_CSV_FIELDS)
+    for record in records:
+        if writer is not None:
+            writer.writerow([
+                json.dumps(record[field], ensure_ascii=False) if field.endswith('_attributes')
+                else _export_value(record[field]) for field in EXPORT_CSV_FIELDS
+            ])
+        else:
+            buffer.write(json.dumps(record, ensure_ascii=False, default=_export_value))
+            buffer.write('\n')
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def accepts_gzip():
+    # Se respeta la calidad: "gzip;q=0" significa que el cliente no quiere gzip
+    return request.accept_encodings['gzip'] > 0
+
+@app.route('/usuarios/export', methods=['GET'])
+@require_api_key
+def export_users():
+    """
+    Exporta todos los usuarios con sus atributos (un registro por usuario) en streaming.
+    Parámetros: format (ndjson o csv), changed_since (fecha ISO: solo usuarios creados o
+    modificados desde entonces). Se comprime con gzip si el cliente lo acepta.
+    """
+    app.logger.info("Recibida petición GET para /usuarios/export")
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in ('ndjson', 'csv'):
+        return jsonify({'error': 'format debe ser ndjson o csv'}), 400
+    changed_since = None
+    if request.args.get('changed_since'):
+        try:
+            changed_since = datetime.fromisoformat(request.args['changed_since'])
+        except ValueError:
+            return jsonify({'error': 'changed_since debe ser una fecha ISO 8601'}), 400
+
+    records = iter_export_records(changed_since)
+    try:
+        # Lanza la consulta antes de responder para poder devolver un error con su código HTTP
+        next(records)
     except pymysql.MySQLError as e:
-        app.logger.error(f"Error de base de datos al obtener todos los usuarios: {e}")
+        app.logger.error("Error de base de datos al exportar usuarios: %s", e)
         return jsonify({'error': f'Error de base de datos: {e}'}), 500
-    finally:
-        if conn:
-            conn.close()
+
+    body = encode_export(records, fmt)
+    headers = {'Content-Disposition': f'attachment; filename=usuarios.{fmt}', 'Vary': 'Accept-Encoding'}
+    if accepts_gzip():
+        body = gzip_chunks(body)
+        headers['Content-Encoding'] = 'gzip'
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(body, mimetype=mimetype, headers=headers)
+
+@app.route('/usuarios/lookup', methods=['POST'])
+@require_api_key
+def lookup_users():
+    """
+    Devuelve los atributos de varios usuarios en una sola pasada por radcheck, radreply y userinfo.
+    Requiere: usernames (lista, máximo LOOKUP_MAX_USERNAMES).
+    Los usuarios inexistentes se listan en `missing`.
+    """
+    app.logger.info("Recibida petición POST en /usuarios/lookup")
+    data = request.get_json(silent=True)
+    usernames = data.get('usernames') if isinstance(data, dict) else None
+    if not isinstance(usernames, list) or not all(isinstance(u, str) for u in usernames):
+        return jsonify({'error': 'Se requiere una lista de nombres de usuario en usernames'}), 400
+    # Eliminar duplicados conservando el orden
+    usernames = list(dict.fromkeys(usernames))
+    if len(usernames) > LOOKUP_MAX_USERNAMES:
+        return jsonify({'error': f'Se permiten como máximo {LOOKUP_MAX_USERNAMES} usuarios por consulta'}), 400
+    if not usernames:
+        return jsonify({'users': {}, 'missing': []})
+
+    placeholders = ', '.join(['%s'] * len(usernames))
+    with db_connection() as conn:
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(f"SELECT username, attribute, op, value FROM radcheck WHERE username IN ({placeholders})", usernames)
+                check_rows = cursor.fetchall()
+                cursor.execute(f"SELECT username, attribute, op, value FROM radreply WHERE username IN ({placeholders})", usernames)
+                reply_rows = cursor.fetchall()
+                cursor.execute(f"SELECT username, firstname, lastname, email, creationdate FROM userinfo WHERE username IN ({placeholders})", usernames)
+                info_rows = cursor.fetchall()
+        except pymysql.MySQLError as e:
+            app.logger.error("Error de base de datos en la consulta en lote: %s", e)
+            return jsonify({'error': f'Error de base de datos: {e}'}), 500
+
+    users = {}
+    def entry(username):
+        if username not in users:
+            users[username] = {'username': username, 'check_attributes': [], 'reply_attributes': [], 'userinfo': None}
+        return users[username]
+
+    for row in check_rows:
+        entry(row.pop('username'))['check_attributes'].append(row)
+    for row in reply_rows:
+        entry(row.pop('username'))['reply_attributes'].append(row)
+    for row in info_rows:
+        entry(row.pop('username'))['userinfo'] = row
+
+    return jsonify({
+        'users': users,
+        'missing': [u for u in usernames if u not in users]
+    })
 
 @app.route('/usuarios/<username>', methods=['GET'])
 @require_api_key
 def get_user(username):
-    """Verifica un usuario y devuelve sus atributos."""
-    app.logger.info(f"Recibida petición GET para /usuarios/{username}")
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({'error': 'No se pudo conectar a la base de datos'}), 500
-        
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT attribute, op, value FROM radcheck WHERE username = %s", (username,))
-            check_attrs = cursor.fetchall()
-            cursor.execute("SELECT attribute, op, value FROM radreply WHERE username = %s", (username,))
-            reply_attrs = cursor.fetchall()
-
-            if not check_attrs and not reply_attrs:
-                return jsonify({'error': 'Usuario no encontrado'}), 404
-
-            return jsonify({
-                'username': username,
-                'check_attributes': check_attrs,
-                'reply_attributes': reply_attrs
-            })
-    finally:
-        if conn:
-            conn.close()
+    """
+    Verifica un usuario y devuelve sus atributos.
+    Las respuestas se sirven desde la caché de atributos cuando es posible y llevan un ETag;
+    con If-None-Match se responde 304 sin consultar la base de datos.
+    """
+    app.logger.info("Recibida petición GET para /usuarios/%s", username)
+    cached = user_cache.get(username)
+    if cached is None:
+        version = user_cache.version(username)
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT attribute, op, value FROM radcheck WHERE username = %s", (username,))
+                check_attrs = cursor.fetchall()
+                cursor.execute("SELECT attribute, op, value FROM radreply WHERE username = %s", (username,))
+                reply_attrs = cursor.fetchall()
+
+        if not check_attrs and not reply_attrs:
+            return jsonify({'error': 'Usuario no encontrado'}), 404
+
+        doc = {
+            'username': username,
+            'check_attributes': check_attrs,
+            'reply_attributes': reply_attrs
+        }
+        cached = {'doc': doc, 'etag': make_etag(doc)}
+        user_cache.set(username, cached, version)
+
+    # Comparación débil: los proxies que comprimen devuelven el ETag como W/"..."
+    if request.if_none_match.contains_weak(cached['etag']):
+        response = Response(status=304)
+    else:
+        response = jsonify(cached['doc'])
+    response.set_etag(cached['etag'])
+    return response
 
 @app.route('/usuarios/<username>', methods=['PATCH'])
 @require_api_key
 def update_user(username):
     """
     Actualiza los datos de un usuario existente.
-    Permite cambiar la contraseña, datos de contacto y atributos de RADIUS.
+    Permite cambiar la contraseña, datos de contacto, atributos de RADIUS y plan.
     """
-    app.logger.info(f"Recibida petición PATCH para /usuarios/{username}")
+    app.logger.info("Recibida petición PATCH para /usuarios/%s", username)
     data = request.get_json()
     if not data:
         return jsonify({'error': 'No se proporcionaron datos para actualizar'}), 400
+    if data.get('plan') is not None:
+        try:
+            validate_plan_name(data['plan'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({'error': 'No se pudo conectar a la base de datos'}), 500
+    with db_connection() as conn:
+        try:
+            with conn.cursor() as cursor:
+                if data.get('plan') is not None:
+                    # Sin esta comprobación quedaría una fila huérfana en radusergroup que
+                    # heredaría un alta posterior con el mismo nombre
+                    if not find_existing_usernames(cursor, [username]):
+                        return jsonify({'error': 'Usuario no encontrado'}), 404
+                    plan = load_plans(cursor, {data['plan']}).get(data['plan'])
+                    if plan is None:
+                        return jsonify({'error': f"El plan {data['plan']} no existe"}), 400
+                    conflicts = plan_conflicts(plan, data)
+                    if conflicts:
+                        return jsonify({'error': plan_conflict_error(plan, conflicts)}), 400
 
-    try:
-        with conn.cursor() as cursor:
-            # Actualizar datos en userinfo
-            if 'firstname' in data:
-                cursor.execute("UPDATE userinfo SET firstname = %s WHERE username = %s", (data['firstname'], username))
-            if 'lastname' in data:
-                cursor.execute("UPDATE userinfo SET lastname = %s WHERE username = %s", (data['lastname'], username))
-            if 'email' in data:
-                cursor.execute("UPDATE userinfo SET email = %s WHERE username = %s", (data['email'], username))
-
-            # Actualizar contraseña en radcheck
-            if 'password' in data:
-                cursor.execute("UPDATE radcheck SET value = %s WHERE username = %s AND attribute = 'Cleartext-Password'", (data['password'], username))
-            
-            # Actualizar otros atributos de radcheck
-            if 'simultaneous_use' in data:
-                cursor.execute("UPDATE radcheck SET value = %s WHERE username = %s AND attribute = 'Simultaneous-Use'", (str(data['simultaneous_use']), username))
-
-            # Actualizar atributos de radreply
-            if 'session_timeout' in data:
-                cursor.execute("UPDATE radreply SET value = %s WHERE username = %s AND attribute = 'Session-Timeout'", (str(data['session_timeout']), username))
-        
-        conn.commit()
-        app.logger.info(f"Usuario {username} actualizado exitosamente.")
-        return jsonify({'success': f'Usuario {username} actualizado correctamente'})
-    except pymysql.MySQLError as e:
-        app.logger.error(f"Error de base de datos al actualizar usuario {username}: {e}")
-        conn.rollback()
-        return jsonify({'error': f'Error de base de datos: {e}'}), 500
-    finally:
-        if conn:
-            conn.close()
+                # Actualizar datos en userinfo en una sola sentencia; updatedate marca el cambio
+                # para las exportaciones incrementales aunque solo cambien atributos de RADIUS
+                fields = [field for field in ('firstname', 'lastname', 'email') if field in data]
+                assignments = ''.join(f"{field} = %s, " for field in fields)
+                cursor.execute(f"UPDATE userinfo SET {assignments}updatedate = %s, updateby = 'api' WHERE username = %s",
+                               [data[field] for field in fields] + [datetime.now(), username])
+
+                # Actualizar contraseña en radcheck
+                if 'password' in data:
+                    cursor.execute("UPDATE radcheck SET value = %s WHERE username = %s AND attribute = 'Cleartext-Password'", (data['password'], username))
+
+                # Actualizar otros atributos de radcheck
+                if 'simultaneous_use' in data:
+                    cursor.execute("UPDATE radcheck SET value = %s WHERE username = %s AND attribute = 'Simultaneous-Use'", (str(data['simultaneous_use']), username))
+
+                # Actualizar atributos de radreply
+                if 'session_timeout' in data:
+                    cursor.execute("UPDATE radreply SET value = %s WHERE username = %s AND attribute = 'Session-Timeout'", (str(data['session_timeout']), username))
+
+                # Cambiar de plan (null lo quita de cualquier plan)
+                if 'plan' in data:
+                    if data['plan'] is None:
+                        unassign_plans(cursor, [username])
+                    else:
+                        assign_plan(cursor, plan, [username])
+
+            conn.commit()
+            user_cache.invalidate(username)
+            app.logger.info("Usuario %s actualizado exitosamente.", username)
+            return jsonify({'success': f'Usuario {username} actualizado correctamente'})
+        except pymysql.MySQLError as e:
+            app.logger.error("Error de base de datos al actualizar usuario %s: %s", username, e)
+            conn.rollback()
+            return jsonify({'error': f'Error de base de datos: {e}'}), 500
 
 @app.route('/usuarios/<username>', methods=['DELETE'])
 @require_api_key
 def delete_user(username):
-    """Elimina un usuario de todas las tablas relevantes, incluyendo la de daloRADIUS."""
-    app.logger.info(f"Recibida petición DELETE para /usuarios/{username}")
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({'error': 'No se pudo conectar a la base de datos'}), 500
-        
-    try:
-        with conn.cursor() as cursor:
-            # Eliminar de las tablas de FreeRADIUS y daloRADIUS para una limpieza completa
-            cursor.execute("DELETE FROM userinfo WHERE username = %s", (username,))
-            cursor.execute("DELETE FROM radcheck WHERE username = %s", (username,))
-            cursor.execute("DELETE FROM radreply WHERE username = %s", (username,))
-            cursor.execute("DELETE FROM radusergroup WHERE username = %s", (username,))
-            cursor.execute("DELETE FROM radacct WHERE username = %s", (username,))
-        
-        conn.commit()
-        if cursor.rowcount > 0:
-            return jsonify({'success': f'Usuario {username} eliminado permanentemente'})
-        else:
-            return jsonify({'error': 'Usuario no encontrado o ya eliminado'}), 404
-    except pymysql.MySQLError as e:
-        app.logger.error(f"Error de base de datos al eliminar usuario {username}: {e}")
-        conn.rollback()
-        return jsonify({'error': f'Error de base de datos: {e}'}), 500
-    finally:
-        if conn:
-            conn.close()
+    """
+    Elimina un usuario de todas las tablas relevantes, incluyendo la de daloRADIUS.
+    El historial de radacct se purga en segundo plano por bloques; la respuesta incluye el trabajo.
+    """
+    app.logger.info("Recibida petición DELETE para /usuarios/%s", username)
+    with db_connection() as conn:
+        try:
+            ensure_jobs_table(conn)
+            with conn.cursor() as cursor:
+                # Eliminar de las tablas de FreeRADIUS y daloRADIUS para una limpieza completa
+                deleted = 0
+                cursor.execute("DELETE FROM userinfo WHERE username = %s", (username,))
+                deleted += cursor.rowcount
+                cursor.execute("DELETE FROM radcheck WHERE username = %s", (username,))
+                deleted += cursor.rowcount
+                cursor.execute("DELETE FROM radreply WHERE username = %s", (username,))
+                deleted += cursor.rowcount
+                cursor.execute("DELETE FROM radusergroup WHERE username = %s", (username,))
+                deleted += cursor.rowcount
+
+                # El historial de radacct puede tener millones de filas: se encola su purga
+                cursor.execute("SELECT MAX(radacctid) AS max_radacctid FROM radacct WHERE username = %s", (username,))
+                max_radacctid = cursor.fetchone()['max_radacctid']
+                job_id = None
+                if max_radacctid is not None:
+                    job_id = enqueue_job(cursor, 'purge_user_acct',
+                                         {'username': username, 'max_radacctid': max_radacctid})
+
+            conn.commit()
+            user_cache.invalidate(username)
+        except pymysql.MySQLError as e:
+            app.logger.error("Error de base de datos al eliminar usuario %s: %s", username, e)
+            conn.rollback()
+            return jsonify({'error': f'Error de base de datos: {e}'}), 500
+
+    if not deleted and job_id is None:
+        return jsonify({'error': 'Usuario no encontrado o ya eliminado'}), 404
+
+    body = {'success': f'Usuario {username} eliminado permanentemente'}
+    if job_id is not None:
+        job_runner.notify()
+        body['radacct_purge_job'] = {'id': job_id, 'url': url_for('get_job', job_id=job_id)}
+    return jsonify(body)
 
 @app.route('/usuarios/<username>/desactivar', methods=['POST'])
 @require_api_key
 def deactivate_user(username):
     """Desactiva una cuenta de usuario añadiendo Auth-Type := Reject."""
-    app.logger.info(f"Recibida petición para DESACTIVAR al usuario {username}")
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({'error': 'No se pudo conectar a la base de datos'}), 500
-    
-    try:
-        with conn.cursor() as cursor:
-            # Primero, eliminar cualquier regla 'Auth-Type' existente para evitar duplicados
-            cursor.execute("DELETE FROM radcheck WHERE username = %s AND attribute = 'Auth-Type'", (username,))
-            
-            # Insertar la regla para rechazar la autenticación
-            sql = "INSERT INTO `radcheck` (`username`, `attribute`, `op`, `value`) VALUES (%s, 'Auth-Type', ':=', 'Reject')"
-            cursor.execute(sql, (username,))
-        
-        conn.commit()
-        app.logger.info(f"Usuario {username} desactivado exitosamente.")
-        return jsonify({'success': f'Usuario {username} desactivado correctamente'})
-    except pymysql.MySQLError as e:
-        app.logger.error(f"Error de base de datos al desactivar usuario {username}: {e}")
-        conn.rollback()
-        return jsonify({'error': f'Error de base de datos: {e}'}), 500
-    finally:
-        if conn:
-            conn.close()
+    app.logger.info("Recibida petición para DESACTIVAR al usuario %s", username)
+    with db_connection() as conn:
+        try:
+            with conn.cursor() as cursor:
+                # Primero, eliminar cualquier regla 'Auth-Type' existente para evitar duplicados
+                cursor.execute("DELETE FROM radcheck WHERE username = %s AND attribute = 'Auth-Type'", (username,))
+
+                # Insertar la regla para rechazar la autenticación
+                sql = "INSERT INTO `radcheck` (`username`, `attribute`, `op`, `value`) VALUES (%s, 'Auth-Type', ':=', 'Reject')"
+                cursor.execute(sql, (username,))
+                touch_users(cursor, [username])
+
+            conn.commit()
+            user_cache.invalidate(username)
+            app.logger.info("Usuario %s desactivado exitosamente.", username)
+            return jsonify({'success': f'Usuario {username} desactivado correctamente'})
+        except pymysql.MySQLError as e:
+            app.logger.error("Error de base de datos al desactivar usuario %s: %s", username, e)
+            conn.rollback()
+            return jsonify({'error': f'Error de base de datos: {e}'}), 500
 
 @app.route('/usuarios/<username>/activar', methods=['POST'])
 @require_api_key
 def activate_user(username):
     """Reactiva una cuenta de usuario eliminando la regla Auth-Type := Reject."""
-    app.logger.info(f"Recibida petición para ACTIVAR al usuario {username}")
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({'error': 'No se pudo conectar a la base de datos'}), 500
-    
+    app.logger.info("Recibida petición para ACTIVAR al usuario %s", username)
+    with db_connection() as conn:
+        try:
+            with conn.cursor() as cursor:
+                # Simplemente eliminar la regla que rechaza la autenticación
+                sql = "DELETE FROM radcheck WHERE username = %s AND attribute = 'Auth-Type'"
+                cursor.execute(sql, (username,))
+                touch_users(cursor, [username])
+
+            conn.commit()
+            user_cache.invalidate(username)
+            app.logger.info("Usuario %s activado exitosamente.", username)
+            return jsonify({'success': f'Usuario {username} activado correctamente'})
+        except pymysql.MySQLError as e:
+            app.logger.error("Error de base de datos al activar usuario %s: %s", username, e)
+            conn.rollback()
+            return jsonify({'error': f'Error de base de datos: {e}'}), 500
+
+@app.route('/planes', methods=['GET'])
+@require_api_key
+def list_plans():
+    """Lista los planes de servicio (perfiles) con sus atributos de grupo."""
+    app.logger.info("Recibida petición GET para /planes")
+    with db_connection() as conn:
+        try:
+            with conn.cursor() as cursor:
+                plans = load_plans(cursor)
+        except pymysql.MySQLError as e:
+            app.logger.error("Error de base de datos al listar los planes: %s", e)
+            return jsonify({'error': f'Error de base de datos: {e}'}), 500
+    return jsonify(list(plans.values()))
+
+@app.route('/planes', methods=['POST'])
+@require_api_key
+def create_plan():
+    """
+    Crea un plan de servicio como grupo de FreeRADIUS.
+    Requiere: name y al menos un atributo (simultaneous_use, session_timeout,
+    check_attributes o reply_attributes).
+    """
+    app.logger.info("Recibida petición POST en /planes")
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Se requiere un objeto JSON'}), 400
     try:
-        with conn.cursor() as cursor:
-            # Simplemente eliminar la regla que rechaza la autenticación
-            sql = "DELETE FROM radcheck WHERE username = %s AND attribute = 'Auth-Type'"
-            cursor.execute(sql, (username,))
-        
-        conn.commit()
-        app.logger.info(f"Usuario {username} activado exitosamente.")
-        return jsonify({'success': f'Usuario {username} activado correctamente'})
-    except pymysql.MySQLError as e:
-        app.logger.error(f"Error de base de datos al activar usuario {username}: {e}")
-        conn.rollback()
-        return jsonify({'error': f'Error de base de datos: {e}'}), 500
-    finally:
-        if conn:
-            conn.close()
+        validate_plan_name(data.get('name'))
+        check, reply = parse_plan_attributes(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not any(v is not None for v in list(check.values()) + list(reply.values())):
+        return jsonify({'error': 'El plan debe definir al menos un atributo'}), 400
+    name = data['name']
+
+    with db_connection() as conn:
+        try:
+            with conn.cursor() as cursor:
+                if load_plans(cursor, {name}):
+                    return jsonify({'error': f'El plan {name} ya existe'}), 409
+                write_plan_attributes(cursor, name, check, reply)
+                plan = load_plans(cursor, {name})[name]
+            conn.commit()
+        except pymysql.MySQLError as e:
+            app.logger.error("Error de base de datos al crear el plan %s: %s", name, e)
+            conn.rollback()
+            return jsonify({'error': f'Error de base de datos: {e}'}), 500
+    app.logger.info("Plan %s creado exitosamente.", name)
+    return jsonify(plan), 201
+
+@app.route('/planes/<name>', methods=['GET'])
+@require_api_key
+def get_plan(name):
+    """Devuelve un plan de servicio con sus atributos."""
+    with db_connection() as conn:
+        try:
+            with conn.cursor() as cursor:
+                plan = load_plans(cursor, {name}).get(name)
+        except pymysql.MySQLError as e:
+            app.logger.error("Error de base de datos al obtener el plan %s: %s", name, e)
+            return jsonify({'error': f'Error de base de datos: {e}'}), 500
+    if plan is None:
+        return jsonify({'error': 'Plan no encontrado'}), 404
+    return jsonify(plan)
+
+@app.route('/planes/<name>', methods=['PATCH'])
+@require_api_key
+def update_plan(name):
+    """
+    Modifica los atributos de un plan. El cambio afecta a todos sus usuarios con una
+    actualización de las filas del grupo. Un atributo con valor null se elimina.
+    """
+    app.logger.info("Recibida petición PATCH para /planes/%s", name)
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not data:
+        return jsonify({'error': 'No se proporcionaron datos para actualizar'}), 400
+    try:
+        check, reply = parse_plan_attributes(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    with db_connection() as conn:
+        try:
+            with conn.cursor() as cursor:
+                if not load_plans(cursor, {name}):
+                    return jsonify({'error': 'Plan no encontrado'}), 404
+                write_plan_attributes(cursor, name, check, reply)
+                plan = load_plans(cursor, {name}).get(name)
+                if plan is None:
+                    conn.rollback()
+                    return jsonify({'error': 'Un plan debe conservar al menos un atributo'}), 400
+            conn.commit()
+        except pymysql.MySQLError as e:
+            app.logger.error("Error de base de datos al actualizar el plan %s: %s", name, e)
+            conn.rollback()
+            return jsonify({'error': f'Error de base de datos: {e}'}), 500
+    app.logger.info("Plan %s actualizado exitosamente.", name)
+    return jsonify(plan)
+
+@app.route('/planes/<name>', methods=['DELETE'])
+@require_api_key
+def delete_plan(name):
+    """Elimina un plan que no tenga usuarios asignados."""
+    app.logger.info("Recibida petición DELETE para /planes/%s", name)
+    with db_connection() as conn:
+        try:
+            with conn.cursor() as cursor:
+                group = plan_group(name)
+                cursor.execute("SELECT 1 FROM radusergroup WHERE groupname = %s LIMIT 1", (group,))
+                if cursor.fetchone():
+                    return jsonify({'error': 'El plan tiene usuarios asignados; muévalos antes de eliminarlo'}), 409
+                cursor.execute("DELETE FROM radgroupcheck WHERE groupname = %s", (group,))
+                deleted = cursor.rowcount
+                cursor.execute("DELETE FROM radgroupreply WHERE groupname = %s", (group,))
+                deleted += cursor.rowcount
+            conn.commit()
+        except pymysql.MySQLError as e:
+            app.logger.error("Error de base de datos al eliminar el plan %s: %s", name, e)
+            conn.rollback()
+            return jsonify({'error': f'Error de base de datos: {e}'}), 500
+    if not deleted:
+        return jsonify({'error': 'Plan no encontrado'}), 404
+    return jsonify({'success': f'Plan {name} eliminado'})
+
+@app.route('/planes/<name>/usuarios', methods=['POST'])
+@require_api_key
+def assign_plan_users(name):
+    """
+    Asigna usuarios al plan en bloque, sacándolos de su plan anterior.
+    Requiere: usernames (lista, máximo BULK_MAX_CHUNK_SIZE). Los usuarios inexistentes se listan en `missing`.
+    """
+    app.logger.info("Recibida petición POST en /planes/%s/usuarios", name)
+    data = request.get_json(silent=True)
+    usernames = data.get('usernames') if isinstance(data, dict) else None
+    if not isinstance(usernames, list) or not usernames or not all(isinstance(u, str) for u in usernames):
+        return jsonify({'error': 'Se requiere una lista de nombres de usuario en usernames'}), 400
+    usernames = list(dict.fromkeys(usernames))
+    if len(usernames) > BULK_MAX_CHUNK_SIZE:
+        return jsonify({'error': f'Se permiten como máximo {BULK_MAX_CHUNK_SIZE} usuarios por petición'}), 400
+
+    with db_connection() as conn:
+        try:
+            with conn.cursor() as cursor:
+                plan = load_plans(cursor, {name}).get(name)
+                if plan is None:
+                    return jsonify({'error': 'Plan no encontrado'}), 404
+                existing = find_existing_usernames(cursor, usernames)
+                assigned = [u for u in usernames if u in existing]
+                if assigned:
+                    assign_plan(cursor, plan, assigned)
+            conn.commit()
+        except pymysql.MySQLError as e:
+            app.logger.error("Error de base de datos al asignar usuarios al plan %s: %s", name, e)
+            conn.rollback()
+            return jsonify({'error': f'Error de base de datos: {e}'}), 500
+
+    if assigned:
+        # Se eliminaron atributos individuales de estos usuarios
+        user_cache.invalidate(*assigned)
+    app.logger.info("%s usuarios asignados al plan %s.", len(assigned), name)
+    return jsonify({
+        'plan': name,
+        'assigned': len(assigned),
+        'missing': [u for u in usernames if u not in existing]
+    })
+
+@app.route('/planes/<name>/migrar', methods=['POST'])
+@require_api_key
+def migrate_plan_users(name):
+    """
+    Mueve a todos los usuarios de otro plan a este con sentencias por conjunto sobre radusergroup.
+    Se eliminan sus atributos individuales que el plan de destino define y las pertenencias
+    duplicadas de quienes ya estaban en él. Requiere: from (nombre del plan de origen).
+    """
+    app.logger.info("Recibida petición POST en /planes/%s/migrar", name)
+    data = request.get_json(silent=True)
+    source = data.get('from') if isinstance(data, dict) else None
+    try:
+        validate_plan_name(source)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if source == name:
+        return jsonify({'error': 'El plan de origen y el de destino son el mismo'}), 400
+
+    with db_connection() as conn:
+        try:
+            with conn.cursor() as cursor:
+                plans = load_plans(cursor, {name, source})
+                if name not in plans:
+                    return jsonify({'error': 'Plan no encontrado'}), 404
+                if source not in plans:
+                    return jsonify({'error': f'El plan {source} no existe'}), 400
+                target, origin = plans[name]['group'], plans[source]['group']
+                cursor.execute("SELECT DISTINCT username FROM radusergroup WHERE groupname = %s", (origin,))
+                usernames = [row['username'] for row in cursor.fetchall()]
+                # Igual que assign_plan: sin valores individuales para lo que define el plan
+                for table, attributes in plan_attribute_names(plans[name]):
+                    if attributes:
+                        cursor.execute(
+                            f"DELETE a FROM `{table}` AS a JOIN radusergroup AS ug ON ug.username = a.username "
+                            f"WHERE ug.groupname = %s AND a.attribute IN ({', '.join(['%s'] * len(attributes))})",
+                            [origin] + attributes)
+                cursor.execute("UPDATE userinfo AS ui JOIN radusergroup AS ug ON ug.username = ui.username "
+                               "SET ui.updatedate = %s, ui.updateby = 'api' WHERE ug.groupname = %s",
+                               (datetime.now(), origin))
+                # Quienes ya estaban en el destino solo pierden la pertenencia al origen
+                cursor.execute("DELETE s FROM radusergroup AS s JOIN radusergroup AS t "
+                               "ON t.username = s.username AND t.groupname = %s WHERE s.groupname = %s",
+                               (target, origin))
+                cursor.execute("UPDATE radusergroup SET groupname = %s WHERE groupname = %s", (target, origin))
+                moved = len(usernames)
+            conn.commit()
+        except pymysql.MySQLError as e:
+            app.logger.error("Error de base de datos al migrar usuarios de %s a %s: %s", source, name, e)
+            conn.rollback()
+            return jsonify({'error': f'Error de base de datos: {e}'}), 500
+    if usernames:
+        user_cache.invalidate(*usernames)
+    app.logger.info("%s usuarios migrados del plan %s al plan %s.", moved, source, name)
+    return jsonify({'plan': name, 'from': source, 'moved': moved})
+
+@app.route('/usuarios/<username>/consumo', methods=['GET'])
+@require_api_key
+def get_user_usage(username):
+    """
+    Devuelve el consumo de un usuario (bytes de entrada/salida, tiempo de sesión) entre
+    `from` y `to` (fechas ISO, por defecto los últimos 30 días), a partir del resumen diario.
+    """
+    app.logger.info("Recibida petición GET para /usuarios/%s/consumo", username)
+    try:
+        date_to = date.fromisoformat(request.args['to']) if 'to' in request.args else date.today()
+        date_from = date.fromisoformat(request.args['from']) if 'from' in request.args else date_to - timedelta(days=30)
+    except ValueError:
+        return jsonify({'error': 'from y to deben ser fechas ISO 8601 (AAAA-MM-DD)'}), 400
+
+    with db_connection() as conn:
+        try:
+            ensure_rollup_tables(conn)
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT day, sessions, session_time, input_octets, output_octets FROM api_usage_daily "
+                    "WHERE username = %s AND day >= %s AND day <= %s ORDER BY day", (username, date_from, date_to))
+                daily = cursor.fetchall()
+                freshness = get_rollup_freshness(cursor)
+        except pymysql.MySQLError as e:
+            app.logger.error("Error de base de datos al obtener el consumo de %s: %s", username, e)
+            return jsonify({'error': f'Error de base de datos: {e}'}), 500
+
+    for row in daily:
+        row['day'] = str(row['day'])
+    return jsonify({
+        'username': username,
+        'from': date_from.isoformat(),
+        'to': date_to.isoformat(),
+        'sessions': sum(int(row['sessions']) for row in daily),
+        'session_time': sum(int(row['session_time']) for row in daily),
+        'input_octets': sum(int(row['input_octets']) for row in daily),
+        'output_octets': sum(int(row['output_octets']) for row in daily),
+        'daily': daily,
+        'freshness': freshness
+    })
+
+@app.route('/sesiones/activas', methods=['GET'])
+@require_api_key
+def get_active_sessions():
+    """
+    Lista las sesiones en curso (acctstoptime IS NULL) anotadas por el agregador.
+    Opcional: username, limit. Las sesiones iniciadas después del último ciclo del
+    agregador aparecen en el siguiente; la respuesta indica la frescura del resumen.
+    """
+    app.logger.info("Recibida petición GET para /sesiones/activas")
+    limit = request.args.get('limit', 100, type=int)
+    if limit is None or not 1 <= limit <= ACTIVE_SESSIONS_MAX_LIMIT:
+        return jsonify({'error': f'limit debe estar entre 1 y {ACTIVE_SESSIONS_MAX_LIMIT}'}), 400
+
+    sql = ("SELECT r.radacctid, r.username, r.acctsessionid, r.nasipaddress, r.framedipaddress, r.callingstationid, "
+           "r.acctstarttime, r.acctupdatetime, r.acctsessiontime, r.acctinputoctets, r.acctoutputoctets "
+           "FROM api_rollup_open o JOIN radacct r ON r.radacctid = o.radacctid WHERE r.acctstoptime IS NULL")
+    params = []
+    if request.args.get('username'):
+        sql += " AND r.username = %s"
+        params.append(request.args['username'])
+    sql += " ORDER BY r.radacctid LIMIT %s"
+    params.append(limit)
+
+    with db_connection() as conn:
+        try:
+            ensure_rollup_tables(conn)
+            with conn.cursor() as cursor:
+                cursor.execute(sql, params)
+                sessions = cursor.fetchall()
+                freshness = get_rollup_freshness(cursor)
+        except pymysql.MySQLError as e:
+            app.logger.error("Error de base de datos al obtener las sesiones activas: %s", e)
+            return jsonify({'error': f'Error de base de datos: {e}'}), 500
+
+    return jsonify({'sessions': sessions, 'freshness': freshness})
+
+@app.route('/radacct/purge', methods=['POST'])
+@require_api_key
+def purge_radacct():
+    """
+    Encola la purga de sesiones de contabilidad cerradas antes de una fecha.
+    Requiere: before (fecha ISO 8601). Devuelve 202 con el trabajo creado.
+    """
+    app.logger.info("Recibida petición POST en /radacct/purge")
+    data = request.get_json(silent=True) or {}
+    try:
+        before = datetime.fromisoformat(str(data['before']))
+    except (KeyError, ValueError):
+        return jsonify({'error': 'Se requiere before como fecha ISO 8601'}), 400
+
+    with db_connection() as conn:
+        try:
+            ensure_jobs_table(conn)
+            with conn.cursor() as cursor:
+                job_id = enqueue_job(cursor, 'purge_acct_before', {'before': before.isoformat(sep=' ')})
+            conn.commit()
+        except pymysql.MySQLError as e:
+            app.logger.error("Error de base de datos al encolar la purga de radacct: %s", e)
+            conn.rollback()
+            return jsonify({'error': f'Error de base de datos: {e}'}), 500
+
+    job_runner.notify()
+    url = url_for('get_job', job_id=job_id)
+    return jsonify({'id': job_id, 'url': url}), 202, {'Location': url}
+
+@app.route('/jobs/<int:job_id>', methods=['GET'])
+@require_api_key
+def get_job(job_id):
+    """Devuelve el estado y progreso de un trabajo en segundo plano."""
+    with db_connection() as conn:
+        try:
+            ensure_jobs_table(conn)
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT * FROM api_jobs WHERE id = %s", (job_id,))
+                job = cursor.fetchone()
+        except pymysql.MySQLError as e:
+            app.logger.error("Error de base de datos al consultar el trabajo %s: %s", job_id, e)
+            return jsonify({'error': f'Error de base de datos: {e}'}), 500
+
+    if job is None:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    return jsonify(_job_row(job))
+
+@app.route('/pool', methods=['GET'])
+@require_api_key
+def pool_stats():
+    """Devuelve las estadísticas del pool de conexiones de este proceso."""
+    return jsonify(db_pool.stats())
+
+@app.route('/cache', methods=['GET'])
+@require_api_key
+def cache_stats():
+    """Devuelve los contadores de la caché de atributos de usuario de este proceso."""
+    return jsonify(user_cache.stats())
+
+def metrics():
+    """Expone las métricas de este proceso en formato de texto de Prometheus."""
+    pool = db_pool.stats()
+    cache = user_cache.stats()
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.expose())
+    for key, kind, doc in (('size', 'gauge', 'Conexiones abiertas en el pool.'),
+                           ('in_use', 'gauge', 'Conexiones prestadas.'),
+                           ('idle', 'gauge', 'Conexiones ociosas.'),
+                           ('waits', 'counter', 'Préstamos que tuvieron que esperar.'),
+                           ('timeouts', 'counter', 'Esperas agotadas.'),
+                           ('wait_time_total', 'counter', 'Segundos totales de espera por una conexión.')):
+        name = f'radius_api_db_pool_{key}'
+        lines.extend([f'# HELP {name} {doc}', f'# TYPE {name} {kind}', f'{name} {pool[key]}'])
+    for key in ('hits', 'misses', 'evictions', 'invalidations'):
+        name = f'radius_api_user_cache_{key}_total'
+        lines.extend([f'# HELP {name} Caché de atributos de usuario: {key}.', f'# TYPE {name} counter', f'{name} {cache[key]}'])
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+app.add_url_rule('/metrics', 'metrics', metrics if METRICS_PUBLIC else require_api_key(metrics))
 
 @app.route('/', methods=['GET'])
 def bienvenida():
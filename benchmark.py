@@ -0,0 +1,528 @@
+# benchmark.py (Pruebas de carga reproducibles para los endpoints de /usuarios)
+#
+# Uso:
+#   python benchmark.py seed --users 100000 --acct-per-user 10
+#   python benchmark.py run --concurrency 16 --requests 2000 --output resultados.json
+#   python benchmark.py run --url http://localhost:8000 --baseline base.json --tolerance 10
+#
+# `seed` crea el esquema de FreeRADIUS/daloRADIUS (si no existe) en la base de datos
+# configurada con las mismas variables DB_* que app.py y la llena con usuarios y
+# sesiones de contabilidad sintéticas. `run` lanza cada escenario con varios hilos,
+# ya sea contra la app en proceso (cliente de pruebas de Flask) o contra una URL, y
+# guarda throughput y latencias p50/p95/p99 en JSON para comparar con una línea base.
+# En ambos modos hace falta un MySQL/MariaDB real: la app usa SQL propio de MySQL
+# (DELETE ... LIMIT, UPDATE/DELETE con JOIN, ON DUPLICATE KEY UPDATE) y no hay sustituto.
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import subprocess
+import http.client
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+import pymysql
+
+SCALES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+SEED_PREFIX = 'bench'
+SEED_BATCH = 5000
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS `userinfo` (
+      `id` INT UNSIGNED NOT NULL AUTO_INCREMENT,
+      `username` VARCHAR(128) NOT NULL DEFAULT '',
+      `firstname` VARCHAR(200) NOT NULL DEFAULT '',
+      `lastname` VARCHAR(200) NOT NULL DEFAULT '',
+      `email` VARCHAR(200) NOT NULL DEFAULT '',
+      `creationdate` DATETIME NULL,
+      `creationby` VARCHAR(128) NULL,
+      `updatedate` DATETIME NULL,
+      `updateby` VARCHAR(128) NULL,
+      PRIMARY KEY (`id`),
+      KEY `username` (`username`),
+      KEY `email` (`email`),
+      KEY `creationdate` (`creationdate`)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS `radcheck` (
+      `id` INT UNSIGNED NOT NULL AUTO_INCREMENT,
+      `username` VARCHAR(64) NOT NULL DEFAULT '',
+      `attribute` VARCHAR(64) NOT NULL DEFAULT '',
+      `op` CHAR(2) NOT NULL DEFAULT '==',
+      `value` VARCHAR(253) NOT NULL DEFAULT '',
+      PRIMARY KEY (`id`),
+      KEY `username` (`username`(32))
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS `radreply` (
+      `id` INT UNSIGNED NOT NULL AUTO_INCREMENT,
+      `username` VARCHAR(64) NOT NULL DEFAULT '',
+      `attribute` VARCHAR(64) NOT NULL DEFAULT '',
+      `op` CHAR(2) NOT NULL DEFAULT '=',
+      `value` VARCHAR(253) NOT NULL DEFAULT '',
+      PRIMARY KEY (`id`),
+      KEY `username` (`username`(32))
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS `radgroupcheck` (
+      `id` INT UNSIGNED NOT NULL AUTO_INCREMENT,
+      `groupname` VARCHAR(64) NOT NULL DEFAULT '',
+      `attribute` VARCHAR(64) NOT NULL DEFAULT '',
+      `op` CHAR(2) NOT NULL DEFAULT '==',
+      `value` VARCHAR(253) NOT NULL DEFAULT '',
+      PRIMARY KEY (`id`),
+      KEY `groupname` (`groupname`(32))
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS `radgroupreply` (
+      `id` INT UNSIGNED NOT NULL AUTO_INCREMENT,
+      `groupname` VARCHAR(64) NOT NULL DEFAULT '',
+      `attribute` VARCHAR(64) NOT NULL DEFAULT '',
+      `op` CHAR(2) NOT NULL DEFAULT '=',
+      `value` VARCHAR(253) NOT NULL DEFAULT '',
+      PRIMARY KEY (`id`),
+      KEY `groupname` (`groupname`(32))
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS `radusergroup` (
+      `id` INT UNSIGNED NOT NULL AUTO_INCREMENT,
+      `username` VARCHAR(64) NOT NULL DEFAULT '',
+      `groupname` VARCHAR(64) NOT NULL DEFAULT '',
+      `priority` INT NOT NULL DEFAULT 1,
+      PRIMARY KEY (`id`),
+      KEY `username` (`username`(32))
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS `radacct` (
+      `radacctid` BIGINT NOT NULL AUTO_INCREMENT,
+      `acctsessionid` VARCHAR(64) NOT NULL DEFAULT '',
+      `acctuniqueid` VARCHAR(32) NOT NULL DEFAULT '',
+      `username` VARCHAR(64) NOT NULL DEFAULT '',
+      `nasipaddress` VARCHAR(15) NOT NULL DEFAULT '',
+      `acctstarttime` DATETIME NULL,
+      `acctupdatetime` DATETIME NULL,
+      `acctstoptime` DATETIME NULL,
+      `acctsessiontime` INT UNSIGNED NULL,
+      `acctinputoctets` BIGINT NULL,
+      `acctoutputoctets` BIGINT NULL,
+      `callingstationid` VARCHAR(50) NOT NULL DEFAULT '',
+      `framedipaddress` VARCHAR(15) NOT NULL DEFAULT '',
+      PRIMARY KEY (`radacctid`),
+      UNIQUE KEY `acctuniqueid` (`acctuniqueid`),
+      KEY `username` (`username`),
+      KEY `acctstarttime` (`acctstarttime`),
+      KEY `acctstoptime` (`acctstoptime`)
+    )
+    """,
+)
+
+SEEDED_TABLES = ('userinfo', 'radcheck', 'radreply', 'radusergroup', 'radacct')
+# Tablas propias de la API que dependen de radacct (sus ids se reinician al vaciarla)
+API_TABLES = ('api_usage_daily', 'api_rollup_open', 'api_jobs')
+
+
+def connect():
+    return pymysql.connect(host=os.environ.get('DB_HOST'),
+                           user=os.environ.get('DB_USER'),
+                           password=os.environ.get('DB_PASSWORD'),
+                           database=os.environ.get('DB_NAME'),
+                           cursorclass=pymysql.cursors.DictCursor,
+                           connect_timeout=10)
+
+
+def seed_username(i):
+    return f'{SEED_PREFIX}{i:07d}'
+
+
+def seed(args):
+    """Crea el esquema y carga usuarios y sesiones sintéticas en lotes."""
+    users = SCALES.get(args.scale, 0) if args.scale else args.users
+    rng = random.Random(args.seed)
+    conn = connect()
+    try:
+        with conn.cursor() as cursor:
+            for sql in SCHEMA:
+                cursor.execute(sql)
+            if args.truncate:
+                for table in SEEDED_TABLES:
+                    cursor.execute(f"TRUNCATE TABLE `{table}`")
+                cursor.execute("SHOW TABLES")
+                existing = {list(row.values())[0] for row in cursor.fetchall()}
+                for table in API_TABLES:
+                    if table in existing:
+                        cursor.execute(f"TRUNCATE TABLE `{table}`")
+                if 'api_rollup_state' in existing:
+                    # La marca apuntaría más allá de los nuevos radacctid
+                    cursor.execute("UPDATE `api_rollup_state` SET `last_radacctid` = 0, `safe_radacctid` = 0, "
+                                   "`horizon_radacctid` = NULL, `horizon_at` = NULL, `updated_at` = NULL")
+        conn.commit()
+
+        started = time.perf_counter()
+        now = datetime.now()
+        for offset in range(0, users, SEED_BATCH):
+            names = [seed_username(i) for i in range(offset, min(offset + SEED_BATCH, users))]
+            with conn.cursor() as cursor:
+                cursor.executemany(
+                    "INSERT INTO `userinfo` (`username`, `firstname`, `lastname`, `email`, `creationdate`, `creationby`) "
+                    "VALUES (%s, %s, %s, %s, %s, %s)",
+                    [(u, 'Bench', u, f'{u}@bench.invalid', now - timedelta(days=rng.randint(0, 365)), 'bench')
+                     for u in names])
+                check = [(u, 'Cleartext-Password', ':=', 'secreto') for u in names]
+                check += [(u, 'Simultaneous-Use', ':=', '1') for u in names]
+                cursor.executemany(
+                    "INSERT INTO `radcheck` (`username`, `attribute`, `op`, `value`) VALUES (%s, %s, %s, %s)", check)
+                cursor.executemany(
+                    "INSERT INTO `radreply` (`username`, `attribute`, `op`, `value`) VALUES (%s, %s, %s, %s)",
+                    [(u, 'Session-Timeout', ':=', '3600') for u in names])
+                acct = []
+                for u in names:
+                    for _ in range(args.acct_per_user):
+                        start = now - timedelta(seconds=rng.randint(0, 30 * 86400))
+                        duration = rng.randint(60, 8 * 3600)
+                        is_open = rng.random() < args.open_ratio
+                        stop = None if is_open else start + timedelta(seconds=duration)
+                        acct.append((f'{rng.getrandbits(64):016x}', f'{rng.getrandbits(128):032x}', u, '10.0.0.1',
+                                     start, start + timedelta(seconds=duration), stop, duration,
+                                     rng.randint(0, 10 ** 9), rng.randint(0, 10 ** 10)))
+                    if len(acct) >= SEED_BATCH:
+                        _insert_acct(cursor, acct)
+                        acct = []
+                if acct:
+                    _insert_acct(cursor, acct)
+            conn.commit()
+            print(f"  {min(offset + SEED_BATCH, users)}/{users} usuarios", file=sys.stderr)
+        print(f"Semilla cargada: {users} usuarios, {users * args.acct_per_user} sesiones "
+              f"en {time.perf_counter() - started:.1f}s")
+    finally:
+        conn.close()
+
+
+def _insert_acct(cursor, rows):
+    cursor.executemany(
+        "INSERT INTO `radacct` (`acctsessionid`, `acctuniqueid`, `username`, `nasipaddress`, `acctstarttime`, "
+        "`acctupdatetime`, `acctstoptime`, `acctsessiontime`, `acctinputoctets`, `acctoutputoctets`) "
+        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)", rows)
+
+
+# --- Clientes ---
+
+class InProcessClient:
+    """
+    Llama a la app con el cliente de pruebas de Flask (sin red, misma base de datos).
+    Los hilos de trabajos y del agregador se desactivan para que no compitan con las
+    peticiones medidas; prepare_rollups() actualiza los resúmenes antes de medir.
+    """
+
+    def __init__(self, api_key):
+        os.environ['JOBS_WORKER_ENABLED'] = '0'
+        os.environ['ROLLUP_ENABLED'] = '0'
+        # Los datos sembrados ya están confirmados: no hace falta esperar al margen de seguridad
+        os.environ.setdefault('ROLLUP_SAFETY_LAG', '0')
+        import app
+        self._module = app
+        self._app = app.app
+        self._headers = {'X-API-Key': api_key}
+        self._local = threading.local()
+
+    def request(self, method, path, body=None, headers=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self._app.test_client()
+        response = client.open(path, method=method, json=body, headers={**self._headers, **(headers or {})})
+        data = response.get_data()
+        return response.status_code, data
+
+    def prepare_rollups(self):
+        # La primera pasada solo fija el horizonte de radacctid; la segunda lo procesa
+        self._module.rollup_usage()
+        return self._module.rollup_usage()
+
+
+class HttpClient:
+    """Cliente HTTP con una conexión keep-alive por hilo."""
+
+    def __init__(self, url, api_key):
+        parts = urlsplit(url)
+        self._https = parts.scheme == 'https'
+        self._netloc = parts.netloc
+        self._base = parts.path.rstrip('/')
+        self._headers = {'X-API-Key': api_key}
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            cls = http.client.HTTPSConnection if self._https else http.client.HTTPConnection
+            conn = self._local.conn = cls(self._netloc, timeout=60)
+        return conn
+
+    def request(self, method, path, body=None, headers=None):
+        headers = {**self._headers, **(headers or {})}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        conn = self._connection()
+        try:
+            conn.request(method, self._base + path, body=payload, headers=headers)
+            response = conn.getresponse()
+            return response.status, response.read()
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            self._local.conn = None
+            raise
+
+
+# --- Escenarios ---
+# Cada escenario es (nombre, función(i, rng) -> (método, ruta, cuerpo), estados aceptados, opciones).
+# Opciones: 'concurrency' (sustituye a --concurrency) y 'on_response' (recibe el cuerpo de
+# cada respuesta aceptada). Se ejecutan en orden: los que crean usuarios o planes van antes
+# de los que los modifican o borran.
+
+def build_scenarios(args, run_id):
+    users = args.users_in_db
+    created = f'{SEED_PREFIX}new{run_id}-'
+    plan = f'{SEED_PREFIX}{run_id}-'
+    today = datetime.now().date()
+    job_ids = []
+
+    def any_user(rng):
+        return seed_username(rng.randrange(users))
+
+    def collect_job(body):
+        job_ids.append(json.loads(body)['id'])
+
+    def any_job(rng):
+        # Sin purgas previas (p. ej. con --only) se consulta un id cualquiera y se acepta 404
+        return rng.choice(job_ids) if job_ids else 1
+
+    return [
+        ('create', lambda i, rng: ('POST', '/usuarios', {
+            'username': f'{created}{i}', 'password': 'secreto', 'simultaneous_use': 1, 'session_timeout': 3600}),
+         (201,)),
+        ('bulk_create', lambda i, rng: ('POST', '/usuarios/bulk', [
+            {'username': f'{created}b{i}-{j}', 'password': 'secreto'} for j in range(args.bulk_size)]),
+         (200,)),
+        ('get', lambda i, rng: ('GET', f'/usuarios/{any_user(rng)}', None), (200,)),
+        ('list', lambda i, rng: ('GET', f'/usuarios?limit=100&prefix={any_user(rng)[:-3]}', None), (200,)),
+        ('list_stream', lambda i, rng: ('GET', f'/usuarios?stream=1&prefix={any_user(rng)[:-3]}', None), (200,)),
+        ('lookup', lambda i, rng: ('POST', '/usuarios/lookup', {
+            'usernames': [any_user(rng) for _ in range(args.lookup_size)]}), (200,)),
+        ('update', lambda i, rng: ('PATCH', f'/usuarios/{created}{i % args.requests}', {
+            'email': f'{i}@bench.invalid', 'session_timeout': 7200}), (200,)),
+        ('deactivate', lambda i, rng: ('POST', f'/usuarios/{created}{i % args.requests}/desactivar', None), (200,)),
+        ('activate', lambda i, rng: ('POST', f'/usuarios/{created}{i % args.requests}/activar', None), (200,)),
+        ('plan_create', lambda i, rng: ('POST', '/planes', {
+            'name': f'{plan}{i}', 'simultaneous_use': 1, 'session_timeout': 3600}), (201,)),
+        ('plan_list', lambda i, rng: ('GET', '/planes', None), (200,)),
+        ('plan_get', lambda i, rng: ('GET', f'/planes/{plan}{i % args.requests}', None), (200,)),
+        ('plan_update', lambda i, rng: ('PATCH', f'/planes/{plan}{i % args.requests}', {'session_timeout': 7200}),
+         (200,)),
+        ('plan_assign', lambda i, rng: ('POST', f'/planes/{plan}{i}/usuarios', {'usernames': [f'{created}{i}']}),
+         (200,)),
+        # Parejas de planes (0<->1, 2<->3, ...), en serie porque recorre radusergroup por groupname;
+        # con un número impar de peticiones el último destino no existe (404)
+        ('plan_migrate', lambda i, rng: ('POST', f'/planes/{plan}{i ^ 1}/migrar', {'from': f'{plan}{i}'}),
+         (200, 404), {'concurrency': 1}),
+        ('usage', lambda i, rng: ('GET', f'/usuarios/{any_user(rng)}/consumo?from={today - timedelta(days=30)}&to={today}',
+                                  None), (200,)),
+        ('active_sessions', lambda i, rng: ('GET', '/sesiones/activas?limit=100', None), (200,)),
+        ('export_incremental', lambda i, rng: ('GET', f'/usuarios/export?format=ndjson&changed_since={today}', None),
+         (200,)),
+        ('delete', lambda i, rng: ('DELETE', f'/usuarios/{created}{i}', None), (200, 404)),
+        ('plan_delete', lambda i, rng: ('DELETE', f'/planes/{plan}{i}', None), (200,)),
+        ('radacct_purge', lambda i, rng: ('POST', '/radacct/purge', {'before': '2000-01-01'}), (202,),
+         {'on_response': collect_job}),
+        ('job_status', lambda i, rng: ('GET', f'/jobs/{any_job(rng)}', None), (200, 404)),
+        ('pool', lambda i, rng: ('GET', '/pool', None), (200,)),
+        ('cache', lambda i, rng: ('GET', '/cache', None), (200,)),
+        ('metrics', lambda i, rng: ('GET', '/metrics', None), (200,)),
+    ]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(client, make_request, accepted, args, concurrency=None, on_response=None):
+    """Ejecuta `args.requests` peticiones con `concurrency` hilos (por defecto --concurrency) y resume las latencias."""
+    latencies = []
+    errors = []
+    counter = iter(range(args.requests))
+    lock = threading.Lock()
+
+    def worker(worker_id):
+        rng = random.Random(args.seed * 1000 + worker_id)
+        local_latencies = []
+        local_errors = 0
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            method, path, body = make_request(i, rng)
+            started = time.perf_counter()
+            try:
+                status, data = client.request(method, path, body)
+                ok = status in accepted
+            except Exception:
+                ok = False
+            local_latencies.append(time.perf_counter() - started)
+            if ok and on_response is not None:
+                on_response(data)
+            if not ok:
+                local_errors += 1
+        with lock:
+            latencies.extend(local_latencies)
+            errors.append(local_errors)
+
+    threads = [threading.Thread(target=worker, args=(w,)) for w in range(concurrency or args.concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+
+    def ms(value):
+        return round(value * 1000, 3) if value is not None else None
+
+    return {
+        'requests': len(latencies),
+        'errors': sum(errors),
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'max_ms': ms(latencies[-1]) if latencies else None,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Imprime la variación frente a la línea base; devuelve True si hay regresiones."""
+    regressed = False
+    print(f"\n{'escenario':<16} {'rps':>10} {'Δrps':>8} {'p95 ms':>10} {'Δp95':>8}")
+    for name, current in results['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if not base:
+            print(f"{name:<16} {current['throughput_rps']:>10} {'nuevo':>8} {current['p95_ms']:>10}")
+            continue
+        d_rps = (current['throughput_rps'] / base['throughput_rps'] - 1) * 100 if base['throughput_rps'] else 0.0
+        d_p95 = (current['p95_ms'] / base['p95_ms'] - 1) * 100 if base['p95_ms'] else 0.0
+        flag = ''
+        if d_rps < -tolerance or d_p95 > tolerance:
+            regressed = True
+            flag = '  <-- regresión'
+        print(f"{name:<16} {current['throughput_rps']:>10} {d_rps:>+7.1f}% {current['p95_ms']:>10} {d_p95:>+7.1f}%{flag}")
+    return regressed
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    api_key = args.api_key or os.environ.get('API_KEY')
+    if not api_key:
+        sys.exit("Se requiere --api-key o la variable de entorno API_KEY")
+    client = HttpClient(args.url, api_key) if args.url else InProcessClient(api_key)
+    run_id = datetime.now().strftime('%Y%m%d%H%M%S')
+    selected = set(args.only.split(',')) if args.only else None
+    if not args.url and (not selected or selected & {'usage', 'active_sessions'}):
+        started = time.perf_counter()
+        processed = client.prepare_rollups()
+        print(f"Resúmenes de radacct actualizados ({processed} filas) en {time.perf_counter() - started:.1f}s",
+              file=sys.stderr)
+
+    results = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'git_revision': git_revision(),
+            'target': args.url or 'in-process',
+            'users_in_db': args.users_in_db,
+            'concurrency': args.concurrency,
+            'requests_per_scenario': args.requests,
+            'bulk_size': args.bulk_size,
+            'lookup_size': args.lookup_size,
+        },
+        'scenarios': {},
+    }
+    for name, make_request, accepted, *options in build_scenarios(args, run_id):
+        if selected and name not in selected:
+            continue
+        print(f"Ejecutando {name}...", file=sys.stderr)
+        summary = run_scenario(client, make_request, accepted, args, **(options[0] if options else {}))
+        results['scenarios'][name] = summary
+        print(f"  {summary['throughput_rps']} req/s  p50={summary['p50_ms']}ms  p95={summary['p95_ms']}ms  "
+              f"p99={summary['p99_ms']}ms  errores={summary['errors']}", file=sys.stderr)
+
+    output = args.output or f'benchmark-{run_id}.json'
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Resultados guardados en {output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pruebas de carga de la API de Radius")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_seed = sub.add_parser('seed', help="Crea el esquema y carga datos sintéticos")
+    p_seed.add_argument('--scale', choices=sorted(SCALES), help="Tamaño predefinido (sustituye a --users)")
+    p_seed.add_argument('--users', type=int, default=10_000)
+    p_seed.add_argument('--acct-per-user', type=int, default=10, help="Sesiones de radacct por usuario")
+    p_seed.add_argument('--open-ratio', type=float, default=0.02, help="Fracción de sesiones abiertas")
+    p_seed.add_argument('--truncate', action='store_true', help="Vacía las tablas de FreeRADIUS antes de cargar")
+    p_seed.add_argument('--seed', type=int, default=42)
+    p_seed.set_defaults(func=seed)
+
+    p_run = sub.add_parser('run', help="Ejecuta los escenarios y guarda los resultados")
+    p_run.add_argument('--url', help="URL base de una API en marcha (por defecto, la app en proceso)")
+    p_run.add_argument('--api-key')
+    p_run.add_argument('--users-in-db', type=int, default=10_000, help="Usuarios cargados con `seed`")
+    p_run.add_argument('--concurrency', type=int, default=8)
+    p_run.add_argument('--requests', type=int, default=1000, help="Peticiones por escenario")
+    p_run.add_argument('--bulk-size', type=int, default=100, help="Filas por petición de alta masiva")
+    p_run.add_argument('--lookup-size', type=int, default=100, help="Usuarios por consulta en lote")
+    p_run.add_argument('--only', help="Escenarios a ejecutar, separados por comas")
+    p_run.add_argument('--output')
+    p_run.add_argument('--baseline', help="JSON de una ejecución anterior para comparar")
+    p_run.add_argument('--tolerance', type=float, default=10.0,
+                       help="Porcentaje de empeoramiento tolerado antes de salir con error")
+    p_run.add_argument('--seed', type=int, default=42)
+    p_run.set_defaults(func=run)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
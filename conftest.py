@@ -0,0 +1 @@
+# conftest.py (Hace que pytest, ejecutado como `pytest`, encuentre app.py en la raíz del repositorio)
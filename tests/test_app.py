@@ -0,0 +1,255 @@
+# tests/test_app.py (Pruebas de regresión que no necesitan un servidor MySQL)
+
+import io
+import os
+import time
+import threading
+import unittest
+from unittest import mock
+
+os.environ.setdefault('JOBS_WORKER_ENABLED', '0')
+os.environ.setdefault('ROLLUP_ENABLED', '0')
+os.environ.setdefault('API_KEY', 'clave-de-pruebas')
+
+import app as api
+
+
+class FakeConnection:
+    """Lo mínimo que usa un cursor de PyMySQL para formatear y enviar sentencias."""
+
+    encoding = 'utf8'
+
+    def escape(self, obj, mapping=None):
+        if isinstance(obj, str):
+            return "'" + obj.replace("'", "''") + "'"
+        return str(obj)
+
+    def literal(self, obj):
+        return self.escape(obj)
+
+
+class RecordingCursor(api.TimedDictCursor):
+    """TimedDictCursor que registra las sentencias en lugar de enviarlas al servidor."""
+
+    def __init__(self, connection):
+        super().__init__(connection)
+        self.sent = []
+
+    def _query(self, q):
+        self.sent.append(q)
+        self.rowcount = q.count(b'),(') + 1 if isinstance(q, (bytes, bytearray)) else 1
+        return self.rowcount
+
+
+class StubConnection:
+    open = True
+    server_status = 0
+
+    def ping(self, reconnect=False):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.open = False
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def test_closed_connection_is_discarded_on_release(self):
+        pool = api.ConnectionPool(StubConnection, min_size=0, max_size=1, timeout=1)
+        entry = pool.acquire()
+        entry.conn.open = False
+        pool.release(entry)
+        self.assertEqual(pool.stats()['discarded'], 1)
+        self.assertTrue(pool.acquire().conn.open)
+
+    def test_handled_network_error_discards_connection(self):
+        pool = api.ConnectionPool(StubConnection, min_size=0, max_size=1, timeout=1)
+        entry = pool.acquire()
+        api._mark_if_broken(entry.conn, api.pymysql.OperationalError(2013, 'Lost connection'))
+        pool.release(entry)
+        self.assertEqual(pool.stats()['idle'], 0)
+
+    def test_waiters_are_served_in_order(self):
+        pool = api.ConnectionPool(StubConnection, min_size=0, max_size=2, timeout=5)
+        timeouts = []
+
+        def worker():
+            for _ in range(100):
+                try:
+                    entry = pool.acquire()
+                    time.sleep(0.001)
+                    pool.release(entry)
+                except api.PoolTimeoutError:
+                    timeouts.append(1)
+
+        threads = [threading.Thread(target=worker) for _ in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = pool.stats()
+        self.assertEqual(timeouts, [])
+        self.assertEqual(stats['checkouts'], 1600)
+        self.assertLess(stats['wait_time_max'], 1.0)
+
+
+class GunicornBody:
+    """Como el cuerpo de gunicorn: read()/readline() con búfer, sin readable() ni readinto()."""
+
+    def __init__(self, data):
+        self._data = io.BytesIO(data)
+
+    def read(self, size=-1):
+        return self._data.read(size)
+
+    def readline(self, size=-1):
+        return self._data.readline(size)
+
+
+class BulkNdjsonTest(unittest.TestCase):
+
+    BODY = b'{"username": "ana", "password": "x"}\n\n{mal\n{"username": "luis", "password": "y"}'
+
+    def read_rows(self, **kwargs):
+        with api.app.test_request_context('/usuarios/bulk', method='POST', content_type='application/x-ndjson',
+                                          **kwargs):
+            return list(api.iter_bulk_rows())
+
+    def check_rows(self, rows):
+        self.assertEqual([row for row, _ in rows], [{'username': 'ana', 'password': 'x'}, None,
+                                                    {'username': 'luis', 'password': 'y'}])
+        self.assertIsNotNone(rows[1][1])
+
+    def test_limited_stream(self):
+        self.check_rows(self.read_rows(data=self.BODY))
+
+    def test_input_terminated(self):
+        self.check_rows(self.read_rows(data=self.BODY, environ_overrides={'wsgi.input_terminated': True}))
+
+    def test_gunicorn_body(self):
+        self.check_rows(self.read_rows(data=self.BODY, environ_overrides={
+            'wsgi.input': GunicornBody(self.BODY), 'wsgi.input_terminated': True}))
+
+
+class MemoryBackend:
+    """Backend compartido en memoria con la misma semántica de versiones que RedisCacheBackend."""
+
+    def __init__(self):
+        self.values = {}
+        self.versions = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def version(self, key):
+        return self.versions.get(key, 0)
+
+    def set(self, key, value, ttl, version):
+        if self.versions.get(key, 0) == version:
+            self.values[key] = value
+
+    def invalidate(self, key):
+        self.versions[key] = self.versions.get(key, 0) + 1
+        self.values.pop(key, None)
+
+
+class UserCacheTest(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        cache = api.UserCache(max_size=2, ttl=30)
+        for key in ('a', 'b'):
+            cache.set(key, {'doc': key}, cache.version(key))
+        cache.get('a')
+        cache.set('c', {'doc': 'c'}, cache.version('c'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), {'doc': 'a'})
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_ttl_expiry(self):
+        cache = api.UserCache(ttl=30)
+        with mock.patch.object(api.time, 'monotonic', return_value=1000.0):
+            cache.set('a', {'doc': 'a'}, cache.version('a'))
+        with mock.patch.object(api.time, 'monotonic', return_value=1029.0):
+            self.assertIsNotNone(cache.get('a'))
+        with mock.patch.object(api.time, 'monotonic', return_value=1031.0):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['expirations'], 1)
+
+    def test_read_overlapping_invalidation_is_not_stored(self):
+        cache = api.UserCache(ttl=30)
+        version = cache.version('a')
+        cache.invalidate('a')
+        cache.set('a', {'doc': 'viejo'}, version)
+        self.assertIsNone(cache.get('a'))
+
+    def test_shared_backend_version_guard(self):
+        backend = MemoryBackend()
+        worker_a = api.UserCache(ttl=30, backend=backend)
+        worker_b = api.UserCache(ttl=30, backend=backend)
+        version = worker_a.version('a')
+        worker_b.invalidate('a')
+        worker_a.set('a', {'doc': 'viejo'}, version)
+        self.assertIsNone(worker_b.get('a'))
+        worker_a.set('a', {'doc': 'nuevo'}, worker_a.version('a'))
+        self.assertEqual(worker_b.get('a'), {'doc': 'nuevo'})
+        self.assertEqual(worker_a.stats()['size'], 0)
+
+
+class UserEtagTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = api.app.test_client()
+        self.headers = {'X-API-Key': os.environ['API_KEY']}
+        doc = {'username': 'etag', 'check_attributes': [], 'reply_attributes': []}
+        self.etag = api.make_etag(doc)
+        api.user_cache.set('etag', {'doc': doc, 'etag': self.etag}, api.user_cache.version('etag'))
+
+    def tearDown(self):
+        api.user_cache.invalidate('etag')
+
+    def test_etag_and_304(self):
+        response = self.client.get('/usuarios/etag', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_etag()[0], self.etag)
+        for value in (f'"{self.etag}"', f'W/"{self.etag}"'):
+            response = self.client.get('/usuarios/etag', headers={**self.headers, 'If-None-Match': value})
+            self.assertEqual(response.status_code, 304)
+        response = self.client.get('/usuarios/etag', headers={**self.headers, 'If-None-Match': '"otro"'})
+        self.assertEqual(response.status_code, 200)
+
+
+class ExportEncodingTest(unittest.TestCase):
+
+    def test_gzip_respects_quality(self):
+        with api.app.test_request_context(headers={'Accept-Encoding': 'gzip;q=0, identity'}):
+            self.assertFalse(api.accepts_gzip())
+        with api.app.test_request_context(headers={'Accept-Encoding': 'gzip'}):
+            self.assertTrue(api.accepts_gzip())
+
+
+class TimedCursorTest(unittest.TestCase):
+
+    def test_executemany_multi_row_insert(self):
+        cursor = RecordingCursor(FakeConnection())
+        rows = cursor.executemany(
+            "INSERT INTO `radcheck` (`username`, `attribute`, `op`, `value`) VALUES (%s, %s, %s, %s)",
+            [('ana', 'Cleartext-Password', ':=', 'secreto'), ('luis', 'Cleartext-Password', ':=', 'otro')])
+        self.assertEqual(rows, 2)
+        # PyMySQL construye el INSERT multi-fila como bytearray y lo pasa a execute()
+        self.assertEqual(len(cursor.sent), 1)
+        self.assertIsInstance(cursor.sent[0], (bytes, bytearray))
+        self.assertIn('radius_api_db_query_duration_seconds_count{statement="INSERT radcheck"}',
+                      '\n'.join(api.db_query_duration.expose()))
+
+    def test_statement_label_accepts_bytes(self):
+        self.assertEqual(api.statement_label(bytearray(b"INSERT IGNORE INTO `api_rollup_open` (x) VALUES (1)")),
+                         'INSERT api_rollup_open')
+        self.assertEqual(api.statement_label(b"UPDATE radcheck SET value = 1"), 'UPDATE radcheck')
+        self.assertEqual(api.statement_label("SELECT * FROM userinfo"), 'SELECT userinfo')
+
+
+if __name__ == '__main__':
+    unittest.main()